@@ -1,9 +1,10 @@
-import numpy as np
-import random
-
 from mesa import Agent
 
 from config import *
+from memory import *
+from rng import *
+from registry import *
+from schedule import PHASES
 
 def get_next_step(x_target, x_curr):
     if x_target > x_curr:
@@ -19,117 +20,97 @@ def get_target_cell(target, curr):
     y_new = get_next_step(y_t, y_curr)
     return (x_new, y_new)
 
-def is_member(coord, list_of_tuples):
-    coord_list = [i[0] for i in list_of_tuples]
-    try:
-        idx = coord_list.index(coord)
-        return idx
-    except ValueError:
-        return None
-
-class AverageMeter(object):
-    """Computes and stores the average and current value"""
-    def __init__(self):
-        self.reset()
-
-    def reset(self):
-        self.val = 0
-        self.avg = 0
-        self.sum = 0
-        self.count = 0
-
-    def update(self, val, n=1):
-        self.val = val
-        self.sum += val * n
-        self.count += n
-        self.avg = self.sum / self.count
-
 class EnergyResource(Agent):
-    def __init__(self, unique_id, model, decay_rate):
+    type = AgentType.ENERGY_RESERVE
+
+    def __init__(self, unique_id, model, decay_rate, rid):
         super().__init__(unique_id, model)
-        self.reserve = max(MEAN_RESERVE/2, np.random.normal(MEAN_RESERVE, STDDEV_RESERVE))
+        self.rid = rid
+        rng = model.streams.get_generator(RESOURCE_STREAM, rid)
+        self.reserve = max(MEAN_RESERVE/2, rng.normal(MEAN_RESERVE, STDDEV_RESERVE))
         self.decay_rate = decay_rate
-        self.type = "energy_reserve"
 
     def step(self):
+        self.step_metabolize()
+
+    def step_metabolize(self):
         self.reserve -= self.decay_rate
         if self.reserve <= 0:
             # remove this energy reserve from all agent's memories
-            for a in self.model.schedule.agents:
-                if isinstance(a, SocietyMember):
-                    idx = is_member(self.pos, a.memory)
-                    if idx is not None:
-                        a.memory.pop(idx)
+            self.model.forget(self)
 
             # remove enrgy from scheduler and world
-            self.model.schedule.remove(self)
+            self.model.remove_agent(self)
+            self.model.resource_index.remove(self)
             self.model.grid.remove_agent(self)
 
-class SocietyMember(Agent):
+class SocietyMember(object):
+    '''
+    Society members are the bulk of the population, so they are kept compact:
+    attributes live in __slots__ instead of a per-instance dict, the id is an
+    integer, and the type and every constant of a type are class attributes.
+    The running mean of memory length is kept as a sum and a count
+    '''
+    __slots__ = ("unique_id", "model", "pos", "sampler", "memory", "energy", "age", "birth",
+                 "mem_len_sum", "mem_len_count", "target", "share_probability", "living_cost")
+
     def __init__(self, unique_id, model, coop):
-        super().__init__(unique_id, model)
-        self.memory = []
-        self.energy = np.random.normal(MEAN_ENERGY, STDDEV_ENERGY, size=1)[0]
+        self.unique_id = unique_id
+        self.model = model
+        self.pos = None
+        self.sampler = model.streams.get_sampler(MEMBER_STREAM, unique_id, block_size=AGENT_SAMPLER_BLOCK_SIZE)
+        self.memory = model.new_memory(self)
+        self.energy = self.sampler.normal(MEAN_ENERGY, STDDEV_ENERGY)
         self.age = 0
-        self.memLen = AverageMeter()
+        self.birth = model.schedule.time
+        self.mem_len_sum = 0
+        self.mem_len_count = 0
         self.target = None
         self.share_probability = coop
 
-    def update_target(self):
-        def criteria(x):
-            # define a selection criteria for target
-            # it is based on amount of energy expected at the destination
-            dest, reserve_size, decay, obs_time = x[0], x[1], x[2], x[3]
-            d = max(dest[0] - self.pos[0], dest[1] - self.pos[1])
-            reserve_size = reserve_size - (self.model.schedule.time - obs_time) * decay
-            expected_energy = reserve_size - d * decay
-            if expected_energy < 0:
-                return 0
-            return expected_energy
+    @property
+    def mean_mem_len(self):
+        if self.mem_len_count == 0:
+            return 0
+        return self.mem_len_sum / self.mem_len_count
 
+    def update_mem_len(self, length):
+        self.mem_len_sum += length
+        self.mem_len_count += 1
+
+    def update_target(self):
         if self.target is None:
             try:
                 if self.is_returning_to_base:
-                    self.target = random.choice(self.model.bases)
+                    self.target = self.sampler.choice(self.model.bases)
             except:
                 pass
 
             if len(self.memory) > 0:
-                # use epsilon-greedy policy for target selection
-                if np.random.uniform() > EPSILON:
-                    self.target = max(self.memory, key=criteria)[0]
-                else:
-                    expected_gain = [criteria(i) for i in self.memory]
-                    total_sum = sum(expected_gain)
-                    selection_p = [(i + 1)/(total_sum + len(expected_gain)) for i in expected_gain]
-
-                    idx_list = list(range(len(self.memory)))
-                    self.target = self.memory[np.random.choice(idx_list, p=selection_p)][0]
+                # use epsilon-greedy policy for target selection, based on
+                # the amount of energy expected at the destination
+                greedy = self.sampler.uniform() > EPSILON
+                self.target = self.memory.select_target(self.pos, self.model.schedule.time, greedy)
 
     def update_memory(self, max_range):
         '''
         Add new energy resources to memory which are within
         the max_range cells from curr position
         '''
-        nbrs = self.model.grid.get_neighbors(self.pos, moore=True, radius=max_range)
-        for e in nbrs:
-            if isinstance(e, EnergyResource):
-                idx = is_member(e.pos, self.memory)
-                if idx is None:
-                    # add new energy resource
-                    self.memory.append((e.pos, e.reserve, e.decay_rate, self.model.schedule.time))
-                else:
-                    # the decay rate needs to be updated in memory
-                    self.memory[idx] = (e.pos, e.reserve, e.decay_rate, self.model.schedule.time)
-        
+        nbrs = self.model.resource_index.get_neighbors(self.pos, radius=max_range)
+        self.observe(nbrs, self.model.schedule.time)
+
+    def observe(self, resources, time):
+        ''' Record the state of the given energy resources in memory '''
+        self.memory.observe(resources, time)
+
         # Update the current length of memory
-        self.memLen.update(len(self.memory))
+        self.update_mem_len(len(self.memory))
 
     def mine_energy(self):
-        cell_occupiers = self.model.grid.get_cell_list_contents(self.pos)
-        energy_sources = [e for e in cell_occupiers if isinstance(e, EnergyResource)]
-        if len(energy_sources) > 0:
-            src = energy_sources[0]
+        if self.model.occupancy.is_occupied(AgentType.ENERGY_RESERVE, self.pos):
+            cell_occupiers = self.model.grid.get_cell_list_contents(self.pos)
+            src = next(e for e in cell_occupiers if isinstance(e, EnergyResource))
         else:
             # the reserve has decayed before agent reached here
             self.target = None
@@ -147,22 +128,22 @@ class SocietyMember(Agent):
         return True
 
     def share_memory(self, agent):
-        for m in self.memory:
-            if np.random.uniform() < self.share_probability:
-                idx = is_member(m[0], agent.memory)
-                if idx is None:
-                    agent.memory.append(m)
+        self.memory.share(agent.memory, self.share_probability)
 
     def communicate(self, max_range):
         ''' Communication between 2 agents '''
-        nbrs = self.model.grid.get_neighbors(self.pos, moore=True, radius=max_range)
+        if BATCHED_COMMUNICATION:
+            nbrs = self.model.comm_partners.get(self, [])
+        else:
+            nbrs = self.model.grid.get_neighbors(self.pos, moore=True, radius=max_range)
         for a in nbrs:
-            if isinstance(a, SocietyMember):
+            # members that died during the tick stay on the grid until its end
+            if isinstance(a, SocietyMember) and a.energy > 0:
                 if a.type == self.type:
-                    if np.random.uniform() <= INTRA_COMMUNICATION_PROB:
+                    if self.sampler.uniform() <= INTRA_COMMUNICATION_PROB:
                         self.share_memory(a)
                 else:
-                    if np.random.uniform() <= INTER_COMMUNICATION_PROB:
+                    if self.sampler.uniform() <= INTER_COMMUNICATION_PROB:
                         self.share_memory(a)
 
     def reproduce(self):
@@ -171,95 +152,117 @@ class SocietyMember(Agent):
         self.energy -= REPRODUCTION_ENERGY
         a = None
         self.model.num_agents += 1
-        if self.type == "explorer":
-            if np.random.uniform() < INHERITANCE_PROB:
-                self.model.num_explorers += 1
-                a = Explorer("explorer_%d" %(self.model.num_agents), self.model, self.share_probability)
+        if self.type == AgentType.EXPLORER:
+            if self.sampler.uniform() < INHERITANCE_PROB:
+                a = Explorer(self.model.num_agents, self.model, self.share_probability)
             else:
-                self.model.num_exploiters += 1
-                a = Exploiter("exploiter_%d" %(self.model.num_agents), self.model, self.share_probability, 0.5)
+                a = Exploiter(self.model.num_agents, self.model, self.share_probability, 0.5)
 
-        elif self.type == "exploiter":
-            if np.random.uniform() < INHERITANCE_PROB:
-                self.model.num_exploiters += 1
-                a = Exploiter("exploiter_%d" %(self.model.num_agents), self.model, self.share_probability, 0.5)
+        elif self.type == AgentType.EXPLOITER:
+            if self.sampler.uniform() < INHERITANCE_PROB:
+                a = Exploiter(self.model.num_agents, self.model, self.share_probability, 0.5)
             else:
-                self.model.num_explorers += 1
-                a = Explorer("explorer_%d" %(self.model.num_agents), self.model, self.share_probability)
+                a = Explorer(self.model.num_agents, self.model, self.share_probability)
 
         else:
             raise Exception("Alien has been found!!")
 
-        # place the new agent in vicinity of the parent
-        nbrs = self.model.grid.get_neighborhood(self.pos, moore=True, radius=3)
-        pos = random.choice(nbrs)
-        self.model.grid.place_agent(a, pos)
+        if INHERIT_MEMORY:
+            a.memory.inherit(self.memory)
 
-        # add the new agent to scheduler
-        self.model.schedule.add(a)
+        # the new agent is placed in vicinity of the parent, and added to
+        # scheduler, at the end of the tick
+        nbrs = self.model.get_neighborhood(self.pos, moore=True, radius=3)
+        pos = self.sampler.choice(nbrs)
+        self.model.births.append((a, pos))
         self.model.expected_ages.append(a.energy / a.living_cost)
 
+    def die(self):
+        ''' Queues the agent for removal from gridworld and scheduler at
+        the end of the tick '''
+        self.model.deaths.append(self)
+
     def step(self):
+        ''' All phases of a tick for this agent alone, for schedulers that
+        activate agents one at a time '''
+        for phase, _ in PHASES:
+            getattr(self, "step_" + phase)()
+
+    def step_sense(self):
+        # sense and add new energy resources into memory
+        if not BATCHED_SENSING and self.model.schedule.time % SENSE_STEPS == 0:
+            self.update_memory(max_range=self.sense_range)
+
+    def step_communicate(self):
+        pass
+
+    def step_move(self):
+        raise NotImplementedError
+
+    def step_metabolize(self):
         raise NotImplementedError
 
+    def step_lifecycle(self):
+        # reproduce if having sufficient energy
+        if self.model.schedule.time % REPRODUCTION_STEPS == 0:
+            if self.energy >= 2 * REPRODUCTION_ENERGY and self.sampler.uniform() < REPRODUCE_PROB:
+                self.reproduce()
+
+        if self.energy <= 0:
+            # On death, record the agent age and its average memory length
+            self.model.death_records.append(self.unique_id, self.type, self.birth, self.model.schedule.time,
+                                            self.age, self.mean_mem_len, self.memory.num_evictions)
+            self.die()
+
 class Explorer(SocietyMember):
+    __slots__ = ("drift", "nbr_prob_dist", "mine_mode", "change_direction_buffer_time",
+                 "is_returning_to_base", "cycle_rate")
+    type = AgentType.EXPLORER
+    communication_range = EXPLORER_COMM_RANGE
+    sense_range = EXPLORER_SENSE_RANGE
+    mining_rate = EXPLORER_MINING_RATE
+    memory_capacity = EXPLORER_MEMORY_CAPACITY
+
     def __init__(self, unique_id, model, coop):
         super().__init__(unique_id, model, coop)
-        self.type = "explorer"
-        self.living_cost = max(0.25, np.random.normal(EXPLORER_COST_MEAN, EXPLORER_COST_STD))
-        self.communication_range = EXPLORER_COMM_RANGE
-        self.sense_range = EXPLORER_SENSE_RANGE
-        self.mining_rate = EXPLORER_MINING_RATE
-        self.drift = random.choice(DIRECTIONS)
+        self.living_cost = max(0.25, self.sampler.normal(EXPLORER_COST_MEAN, EXPLORER_COST_STD))
+        self.drift = self.sampler.choice(DIRECTIONS)
         self.nbr_prob_dist = self.get_nbr_prob_dist()
         self.mine_mode = False
         self.change_direction_buffer_time = 0
         self.is_returning_to_base = False
-        self.cycle_rate = int(np.random.uniform(BASE_RETURN_INTERVAL - BASE_RETURN_DEV, BASE_RETURN_INTERVAL + BASE_RETURN_DEV))
-
-    def die(self):
-        ''' Removes the agent from gridworld and scheduler '''
-        self.model.num_explorers -= 1
-        self.model.schedule.remove(self)
-        self.model.grid.remove_agent(self)
+        self.cycle_rate = int(self.sampler.uniform(BASE_RETURN_INTERVAL - BASE_RETURN_DEV, BASE_RETURN_INTERVAL + BASE_RETURN_DEV))
 
     def get_nbr_prob_dist(self):
         ''' Gives a probability distribution of selecting neighbor cells
         so that overall a drift is achieved in one direction '''
-        dist = [0.25 / 5] * 8
-        if self.drift == 0:
-            idx = [5, 6, 7]
-        elif self.drift == 1:
-            idx = [2, 4, 7]
-        elif self.drift == 2:
-            idx = [0, 1, 2]
-        elif self.drift == 3:
-            idx = [0, 3, 5]
-
-        for i in idx:
-            dist[i] = 0.25
-        return dist
+        return get_drift_dist(self.drift)
 
     def get_next_cell(self):
-        nbrs = self.model.grid.get_neighborhood(self.pos, moore=True, radius=1)
+        nbrs = self.model.get_neighborhood(self.pos, moore=True, radius=1)
         if len(nbrs) != 8:
             # agent is at boundary
-            cell = random.choice(nbrs)
+            cell = self.sampler.choice(nbrs)
             self.change_direction_buffer_time += 1
             if self.change_direction_buffer_time % 15 == 0:
                 self.drift = (self.drift + 2) % 4
                 self.nbr_prob_dist = self.get_nbr_prob_dist()
         else:
             # drift in one direction by choosing that direction with higher probability
-            nbr_idx = list(range(8))
-            cell_idx = np.random.choice(nbr_idx, p=self.nbr_prob_dist)
+            if BATCHED_SAMPLING:
+                cell_idx = self.sampler.drift_move(self.drift)
+            else:
+                nbr_idx = list(range(8))
+                cell_idx = self.sampler.rng.choice(nbr_idx, p=self.nbr_prob_dist)
             cell = nbrs[cell_idx]
         return cell
 
     def borrow_energy(self):
-        nbrs = self.model.grid.get_neighborhood(self.pos, moore=True, radius=ENERGY_TRANSMIT_RADIUS)
-        for a in nbrs:
-            if isinstance(a, Exploiter) and np.random.uniform < a.energy_share_prob:
+        if not EXPLORERS_BORROW_ENERGY:
+            return False
+        cells = self.model.occupancy.get_occupied(AgentType.EXPLOITER, self.pos, ENERGY_TRANSMIT_RADIUS)
+        for a in self.model.grid.iter_cell_list_contents(cells):
+            if isinstance(a, Exploiter) and self.sampler.uniform() < a.energy_share_prob:
                 if a.energy > THRESHOLD_EXPLOITER:
                     self.energy += self.mining_rate
                     a.energy -= self.mining_rate
@@ -267,15 +270,12 @@ class Explorer(SocietyMember):
         return False
 
 
-    def step(self):
-        # sense and add new energy resources into memory
-        if self.model.schedule.time % SENSE_STEPS == 0:
-            self.update_memory(max_range=self.sense_range)
-
+    def step_communicate(self):
         # share memory with other agents
         if self.model.schedule.time % COMMUNICATION_STEPS == 0:
             self.communicate(max_range=self.communication_range)
 
+    def step_move(self):
         # return to base to communicate
         if self.model.schedule.time % BASE_RETURN_INTERVAL == 0:
             self.is_returning_to_base = not self.is_returning_to_base
@@ -290,7 +290,7 @@ class Explorer(SocietyMember):
                         self.is_returning_to_base = False
                 else:
                     self.is_returning_to_base = False
-                    self.drift = random.choice(DIRECTIONS)
+                    self.drift = self.sampler.choice(DIRECTIONS)
 
             elif self.mine_mode is True:
                 if self.energy <= MINING_FACTOR * THRESHOLD_EXPLORER:
@@ -323,55 +323,47 @@ class Explorer(SocietyMember):
                 new_position = self.get_next_cell()
 
         self.model.grid.move_agent(self, new_position)
+
+    def step_metabolize(self):
         self.energy -= self.living_cost
 
         if not self.mine_mode and not self.is_returning_to_base and self.energy < THRESHOLD_EXPLORER:
             # when energy is low, switch to mining mode
             self.mine_mode = True
 
-        if self.model.schedule.time % REPRODUCTION_STEPS == 0:
-            if self.energy >= 2 * REPRODUCTION_ENERGY and np.random.uniform() < REPRODUCE_PROB:
-                self.reproduce()
-
         self.age += 1
-        if self.energy <= 0:
-            # On death, append the agent age, and the average memory length to model
-            self.model.ages.append((self.unique_id, self.age))
-            self.model.memoryLens.append((self.unique_id, self.memLen.avg))
-            self.die()
 
 class Exploiter(SocietyMember):
+    __slots__ = ("static_living_cost", "is_at_base", "is_exploiting", "energy_share_prob", "cost")
+    type = AgentType.EXPLOITER
+    communication_range = EXPLOITER_COMM_RANGE
+    sense_range = EXPLOITER_SENSE_RANGE
+    mining_rate = EXPLOITER_MINING_RATE
+    memory_capacity = EXPLOITER_MEMORY_CAPACITY
+
     def __init__(self, unique_id, model, coop, e_prob):
         super().__init__(unique_id, model, coop)
-        self.type = "exploiter"
-        self.living_cost = max(0.5, np.random.normal(EXPLOITER_COST_MEAN, EXPLOITER_COST_STD))
+        self.living_cost = max(0.5, self.sampler.normal(EXPLOITER_COST_MEAN, EXPLOITER_COST_STD))
         self.static_living_cost = max(0.2, self.living_cost / 4)
-        self.communication_range = EXPLOITER_COMM_RANGE
-        self.sense_range = EXPLOITER_SENSE_RANGE
-        self.mining_rate = EXPLOITER_MINING_RATE
         self.is_at_base = False
         self.is_exploiting = False
         self.energy_share_prob = e_prob
+        # energy spent moving or resting in the current tick
+        self.cost = 0
 
-    def die(self):
-        ''' Removes the agent from gridworld and scheduler '''
-        self.model.num_exploiters -= 1
-        self.model.schedule.remove(self)
-        self.model.grid.remove_agent(self)
-
-    def move(self):
+    def exploit(self):
         self.update_target()
 
         # target is not updated since no resources in memory
         if self.target is None:
-            self.target = random.choice(self.model.bases)
+            self.target = self.sampler.choice(self.model.bases)
             self.is_exploiting = False
 
         if self.target == self.pos:
             if self.is_at_base:
                 self.is_at_base = False
                 self.is_exploiting = False
-                self.energy -= self.static_living_cost
+                self.cost = self.static_living_cost
 
             elif self.energy <= MINING_FACTOR * THRESHOLD_EXPLOITER:
                 success = self.mine_energy()
@@ -380,40 +372,29 @@ class Exploiter(SocietyMember):
                     self.update_target()
                     if self.target is None:
                         # if no other target is found, go back to base
-                        self.target = random.choice(self.model.bases)
+                        self.target = self.sampler.choice(self.model.bases)
                         self.is_at_base = True
-                    self.energy -= self.static_living_cost
+                    self.cost = self.static_living_cost
 
             else:
                 # sufficient energy has been restored
-                # remove current pos from memory and return to base
-                tmp = None
-                idx = is_member(self.pos, self.memory)
-                if idx:
-                    tmp = self.memory[idx]
-                    del self.memory[idx]
-
-                self.target = random.choice(self.model.bases)
-                self.is_at_base = True
+                # return to base, and move current pos to the back of memory
+                # to mine at later times
+                if self.pos in self.memory:
+                    self.memory.move_to_end(self.pos)
 
-                # add current pos back in memory to mine at later times
-                if idx:
-                    self.memory.append(tmp)
-                self.energy -= self.static_living_cost
+                self.target = self.sampler.choice(self.model.bases)
+                self.is_at_base = True
+                self.cost = self.static_living_cost
 
         else:
             # move towards target
             new_position = get_target_cell(self.target, self.pos)
             self.model.grid.move_agent(self, new_position)
-            self.energy -= self.living_cost
-
-
-    def step(self):
-        self.age += 1
-        # sense and add new energy resources into memory
-        if self.model.schedule.time % SENSE_STEPS == 0:
-            self.update_memory(max_range=self.sense_range)
+            self.cost = self.living_cost
 
+    def step_move(self):
+        self.cost = 0
         if not self.is_exploiting and self.energy < THRESHOLD_EXPLOITER:
             if len(self.memory) > 0:
                 self.is_exploiting = True
@@ -421,23 +402,18 @@ class Exploiter(SocietyMember):
         if self.is_exploiting:
             # once agent acquires knowledge of energy resources
             # move towards it
-            self.move()
+            self.exploit()
 
-        elif np.random.uniform() < EXPLOITER_MOVE_PROB:
+        elif self.sampler.uniform() < EXPLOITER_MOVE_PROB:
             # move randomly with small probability
-            nbrs = self.model.grid.get_neighborhood(self.pos, moore=True, radius=1)
-            new_position = random.choice(nbrs)
+            nbrs = self.model.get_neighborhood(self.pos, moore=True, radius=1)
+            new_position = self.sampler.choice(nbrs)
             self.model.grid.move_agent(self, new_position)
-            self.energy -= self.living_cost
+            self.cost = self.living_cost
 
         else:
-            self.energy -= self.static_living_cost
-
-        # reproduce if having sufficient energy
-        if self.model.schedule.time % REPRODUCTION_STEPS == 0:
-            if self.energy >= 2 * REPRODUCTION_ENERGY and np.random.uniform() < REPRODUCE_PROB:
-                self.reproduce()
+            self.cost = self.static_living_cost
 
-        if self.energy <= 0:
-            self.die()
-            self.model.ages.append((self.unique_id, self.age))
+    def step_metabolize(self):
+        self.age += 1
+        self.energy -= self.cost
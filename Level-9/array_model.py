@@ -0,0 +1,708 @@
+import numpy as np
+
+from config import *
+from memory import get_expected_energy
+from space import CellList, window_sum, window_max
+from rng import *
+from registry import *
+
+# type codes of society members
+EXPLORER = int(AgentType.EXPLORER)
+EXPLOITER = int(AgentType.EXPLOITER)
+
+# state arrays with one entry per living member, kept aligned with each other
+# and ordered by replica
+MEMBER_FIELDS = (
+    "replica", "serial", "kind", "birth", "x", "y", "energy", "living_cost", "static_living_cost",
+    "energy_share_prob", "age", "drift", "change_direction_buffer_time",
+    "mine_mode", "is_returning_to_base", "is_at_base", "is_exploiting",
+    "has_target", "target_x", "target_y", "mem_sum", "mem_count", "memory",
+)
+
+def get_offsets(radius):
+    ''' Offsets of the moore neighborhood of a cell without its center, in
+    the order of MultiGrid.get_neighborhood '''
+    d = np.arange(-radius, radius + 1)
+    dx, dy = np.repeat(d, len(d)), np.tile(d, len(d))
+    center = (dx == 0) & (dy == 0)
+    return dx[~center], dy[~center]
+
+NBR_DX, NBR_DY = get_offsets(1)
+BIRTH_DX, BIRTH_DY = get_offsets(3)
+
+def uniform(rng, r, n):
+    return rng.random(n)
+
+class ArraySchedule(object):
+    ''' Stands in for the mesa scheduler of a World, for code that only reads
+    the time and the population of a world '''
+    def __init__(self, world):
+        self.world = world
+        self.time = 0
+
+    def get_agent_count(self):
+        return len(self.world.kind) + int(self.world.res_alive.sum())
+
+class Replica(object):
+    ''' Parameters, random streams and logged outputs of one replica '''
+    def __init__(self, coop, e_prob, seed):
+        self.share_probability = coop
+        self.e_prob = e_prob
+        self.streams = Streams(seed)
+        self.seed = self.streams.seed
+        self.setup_rng = self.streams.get_generator(SETUP_STREAM)
+        self.rng = self.streams.get_generator(ARRAY_STREAM)
+
+        self.num_agents = 0
+        self.num_explorers = 0
+        self.num_exploiters = 0
+        self.death_records = DeathRecords()
+        self.expected_ages = []
+        self.member_tracker = []
+        self.energy_tracker = []
+
+class ReplicaWorld(object):
+    '''
+    The World dynamics on struct-of-arrays state, for a batch of independent
+    replicas at once. Every member attribute of Explorer and Exploiter is an
+    array with one entry per living member of any replica, resource arrays
+    have a leading replica dimension, and each tick advances every replica
+    with the same array operations instead of calling a step per agent.
+
+    Each replica has its own coop, e_prob and seed, and makes its random
+    draws from its own streams in the same order as when it is simulated
+    alone, so it gives identical results whatever batch it is part of.
+
+    Members act at the same time rather than one after the other in random
+    order. Hence within a tick, memories shared with a member are not passed
+    on further, and explorers borrowing energy see the energy exploiters had
+    at the start of the tick. Memories hold, for each resource id, the index
+    of the sensing round their record comes from, and records are looked up
+    in the history of resource states, so memories are always indexed by
+    resource id, like the knowledge store, whatever USE_KNOWLEDGE_STORE says.
+    Memory capacities are not supported
+    '''
+    def __init__(self, N, coops, e_probs, seeds, width=100, height=100):
+        if EXPLORER_MEMORY_CAPACITY is not None or EXPLOITER_MEMORY_CAPACITY is not None:
+            raise ValueError("memory capacities are not supported by the array engine")
+        self.replicas = [Replica(coop, e_prob, seed) for coop, e_prob, seed in zip(coops, e_probs, seeds)]
+        self.num_replicas = len(self.replicas)
+        self.width = width
+        self.height = height
+        self.schedule = ArraySchedule(self)
+        self.running = True
+        self.num_energy_resources = RESERVE_SIZE
+        self.share_probability = np.array([rep.share_probability for rep in self.replicas])
+
+        # states of the resources at every sensing round, indexed by replica,
+        # round and resource id. Room for rounds is made by doubling, and
+        # only the first num_rounds are filled
+        self.num_rounds = 0
+        self.sense_times = np.zeros(1, dtype=int)
+        self.history = dict((name, np.zeros((self.num_replicas, 1, RESERVE_SIZE))) for name in ("x", "y", "reserve", "decay"))
+
+        for name in MEMBER_FIELDS:
+            setattr(self, name, np.zeros(0, dtype=int))
+        self.memory = np.zeros((0, RESERVE_SIZE), dtype=int)
+
+        bases, members, resources = [], [], []
+        for r, rep in enumerate(self.replicas):
+            rep.population_center_x = int(rep.setup_rng.integers(POP_MARGIN, width - POP_MARGIN))
+            rep.population_center_y = int(rep.setup_rng.integers(POP_MARGIN, height - POP_MARGIN))
+            bases.append(self.init_base(rep))
+            rep.decay_rates = self.init_decay_rates(rep)
+
+            # society members are confined at beginning
+            kind = np.where(rep.setup_rng.random(N) <= EXPLORER_RATIO, EXPLORER, EXPLOITER)
+            x = rep.setup_rng.integers(rep.population_center_x - POP_SPREAD, rep.population_center_x + POP_SPREAD, N)
+            y = rep.setup_rng.integers(rep.population_center_y - POP_SPREAD, rep.population_center_y + POP_SPREAD, N)
+            members.append((kind, x, y))
+            rep.num_agents = N
+
+            # energy reserves, with the same reserves as World
+            res_x = rep.setup_rng.integers(0, width, RESERVE_SIZE)
+            res_y = rep.setup_rng.integers(0, height, RESERVE_SIZE)
+            reserve = [max(MEAN_RESERVE/2, rep.streams.get_generator(RESOURCE_STREAM, i).normal(MEAN_RESERVE, STDDEV_RESERVE))
+                       for i in range(RESERVE_SIZE)]
+            resources.append((res_x, res_y, reserve, rep.decay_rates))
+
+        # base cells of all replicas laid end to end
+        self.base_count = np.array([len(x) for x, _ in bases])
+        self.base_start = np.cumsum(self.base_count) - self.base_count
+        self.base_x = np.concatenate([x for x, _ in bases])
+        self.base_y = np.concatenate([y for _, y in bases])
+
+        self.res_x, self.res_y, self.res_reserve, self.res_decay = [np.array(a) for a in zip(*resources)]
+        self.res_reserve = self.res_reserve.astype(float)
+        self.res_decay = self.res_decay.astype(float)
+        self.res_alive = np.ones((self.num_replicas, RESERVE_SIZE), dtype=bool)
+
+        # add social agents to the world
+        replica = np.repeat(np.arange(self.num_replicas), N)
+        kind, x, y = [np.concatenate(a) for a in zip(*members)]
+        e_prob = np.array([rep.e_prob for rep in self.replicas], dtype=float)[replica]
+        self.add_members(replica, np.tile(np.arange(1, N + 1), self.num_replicas), kind, x, y, e_prob)
+
+    def init_base(self, rep):
+        dx, dy = get_offsets(POP_SPREAD)
+        x = np.append(dx, 0) + rep.population_center_x
+        y = np.append(dy, 0) + rep.population_center_y
+        inside = (x >= 0) & (x < self.width) & (y >= 0) & (y < self.height)
+        order = np.lexsort((y[inside], x[inside]))
+        return x[inside][order], y[inside][order]
+
+    def init_decay_rates(self, rep):
+        decay_rates = list(rep.setup_rng.uniform(-0.1, 0.02, self.num_energy_resources))
+        rep.setup_rng.shuffle(decay_rates)
+        return decay_rates
+
+    def draw(self, replica, sample):
+        '''
+        Draws for a group of members, each from the stream of its own replica.
+        replica holds the replica of every member in increasing order, and
+        sample(rng, r, n) makes the n draws of replica r
+        '''
+        counts = np.bincount(replica, minlength=self.num_replicas).tolist()
+        return np.concatenate([sample(rep.rng, r, n) for r, (rep, n) in enumerate(zip(self.replicas, counts))])
+
+    def get_blocks(self):
+        ''' Start and end of the members of each replica '''
+        r = np.arange(self.num_replicas)
+        return np.searchsorted(self.replica, r), np.searchsorted(self.replica, r, side="right")
+
+    def add_members(self, replica, serial, kind, x, y, energy_share_prob, memory=None):
+        ''' Add new members, ordered by replica, with freshly drawn energies
+        and living costs '''
+        n = len(serial)
+        is_explorer = kind == EXPLORER
+        energy = self.draw(replica, lambda rng, r, n: rng.normal(MEAN_ENERGY, STDDEV_ENERGY, n))
+        explorer_cost = np.maximum(0.25, self.draw(replica, lambda rng, r, n: rng.normal(EXPLORER_COST_MEAN, EXPLORER_COST_STD, n)))
+        exploiter_cost = np.maximum(0.5, self.draw(replica, lambda rng, r, n: rng.normal(EXPLOITER_COST_MEAN, EXPLOITER_COST_STD, n)))
+        living_cost = np.where(is_explorer, explorer_cost, exploiter_cost)
+        if memory is None:
+            memory = np.full((n, RESERVE_SIZE), -1, dtype=int)
+        new = {
+            "replica": replica, "serial": serial, "kind": kind, "birth": np.full(n, self.schedule.time), "x": x, "y": y, "energy": energy,
+            "living_cost": living_cost, "static_living_cost": np.maximum(0.2, living_cost / 4),
+            "energy_share_prob": energy_share_prob, "age": np.zeros(n, dtype=int),
+            "drift": self.draw(replica, lambda rng, r, n: rng.integers(0, len(DIRECTIONS), n)),
+            "change_direction_buffer_time": np.zeros(n, dtype=int),
+            "mine_mode": np.zeros(n, dtype=bool), "is_returning_to_base": np.zeros(n, dtype=bool),
+            "is_at_base": np.zeros(n, dtype=bool), "is_exploiting": np.zeros(n, dtype=bool),
+            "has_target": np.zeros(n, dtype=bool), "target_x": np.zeros(n, dtype=int), "target_y": np.zeros(n, dtype=int),
+            "mem_sum": np.zeros(n), "mem_count": np.zeros(n, dtype=int), "memory": memory,
+        }
+        order = np.argsort(np.concatenate([self.replica, replica]), kind="stable")
+        for name in MEMBER_FIELDS:
+            old = getattr(self, name)
+            setattr(self, name, np.concatenate([old.astype(new[name].dtype, copy=False), new[name]])[order])
+
+        explorers = np.bincount(replica[is_explorer], minlength=self.num_replicas)
+        exploiters = np.bincount(replica[~is_explorer], minlength=self.num_replicas)
+        for rep, e, x in zip(self.replicas, explorers.tolist(), exploiters.tolist()):
+            rep.num_explorers += e
+            rep.num_exploiters += x
+        for r, expected in zip(replica.tolist(), (energy / living_cost).tolist()):
+            self.replicas[r].expected_ages.append(expected)
+
+    def keep_members(self, keep):
+        for name in MEMBER_FIELDS:
+            setattr(self, name, getattr(self, name)[keep])
+
+    def get_records(self, idx):
+        ''' Arrays of the remembered resource states of members idx, with a
+        mask of the records they actually hold '''
+        mem = self.memory[idx]
+        known = mem >= 0
+        rounds = np.maximum(mem, 0)
+        replica = self.replica[idx, None]
+        rids = np.broadcast_to(np.arange(RESERVE_SIZE), mem.shape)
+        h = self.history
+        return (known, h["x"][replica, rounds, rids], h["y"][replica, rounds, rids],
+                h["reserve"][replica, rounds, rids], h["decay"][replica, rounds, rids], self.sense_times[rounds])
+
+    def random_neighbor(self, idx, dx, dy):
+        ''' Uniformly chosen cell among the in-grid neighbors with offsets dx, dy '''
+        x = self.x[idx, None] + dx
+        y = self.y[idx, None] + dy
+        valid = (x >= 0) & (x < self.width) & (y >= 0) & (y < self.height)
+        k = np.floor(self.draw(self.replica[idx], uniform) * valid.sum(axis=1))
+        choice = np.argmax(valid & (np.cumsum(valid, axis=1) == k[:, None] + 1), axis=1)
+        rows = np.arange(len(idx))
+        return x[rows, choice], y[rows, choice]
+
+    def set_base_target(self, idx):
+        replica = self.replica[idx]
+        choice = self.base_start[replica] + self.draw(replica, lambda rng, r, n: rng.integers(0, self.base_count[r], n))
+        self.target_x[idx] = self.base_x[choice]
+        self.target_y[idx] = self.base_y[choice]
+        self.has_target[idx] = True
+
+    def update_target(self, idx):
+        ''' SocietyMember.update_target for the members idx '''
+        idx = idx[~self.has_target[idx]]
+        self.set_base_target(idx[self.is_returning_to_base[idx]])
+
+        known, x, y, reserve, decay, obs_time = self.get_records(idx)
+        remembers = known.any(axis=1)
+        idx, known = idx[remembers], known[remembers]
+        if len(idx) == 0:
+            return
+        x, y, reserve, decay, obs_time = x[remembers], y[remembers], reserve[remembers], decay[remembers], obs_time[remembers]
+
+        # epsilon-greedy choice by the amount of energy expected at the destination
+        greedy = self.draw(self.replica[idx], uniform) > EPSILON
+        pos = (self.x[idx, None], self.y[idx, None])
+        expected = get_expected_energy(x, y, reserve, decay, obs_time, pos, self.schedule.time)
+        best = np.argmax(np.where(known, expected, -1), axis=1)
+        cdf = np.cumsum(np.where(known, expected + 1, 0), axis=1)
+        u = self.draw(self.replica[idx], uniform) * cdf[:, -1]
+        soft = (cdf <= u[:, None]).sum(axis=1)
+        choice = np.where(greedy, best, soft)
+
+        rows = np.arange(len(idx))
+        self.target_x[idx] = x[rows, choice]
+        self.target_y[idx] = y[rows, choice]
+        self.has_target[idx] = True
+
+    def move_towards_target(self, idx):
+        self.x[idx] += np.sign(self.target_x[idx] - self.x[idx])
+        self.y[idx] += np.sign(self.target_y[idx] - self.y[idx])
+
+    def move_randomly(self, idx):
+        self.x[idx], self.y[idx] = self.random_neighbor(idx, NBR_DX, NBR_DY)
+
+    def get_next_cell(self, idx):
+        ''' Explorer.get_next_cell, explorers idx are moved to their next cell '''
+        x, y = self.x[idx], self.y[idx]
+        at_boundary = (x == 0) | (x == self.width - 1) | (y == 0) | (y == self.height - 1)
+
+        # agents at boundary move to any neighbor, and turn around now and then
+        edge = idx[at_boundary]
+        self.move_randomly(edge)
+        self.change_direction_buffer_time[edge] += 1
+        turn = edge[self.change_direction_buffer_time[edge] % 15 == 0]
+        self.drift[turn] = (self.drift[turn] + 2) % 4
+
+        # drift in one direction by choosing that direction with higher probability
+        inner = idx[~at_boundary]
+        u = self.draw(self.replica[inner], uniform)
+        cell = (DRIFT_CDFS[self.drift[inner]] <= u[:, None]).sum(axis=1)
+        self.x[inner] += NBR_DX[cell]
+        self.y[inner] += NBR_DY[cell]
+
+    def mine_energy(self, idx, mining_rate):
+        ''' Members idx mine the resource on their cell. Returns the mask of
+        members that found one '''
+        found = self.resource_at[self.replica[idx], self.x[idx], self.y[idx]] >= 0
+        self.energy[idx[found]] += mining_rate
+
+        # the reserve has decayed before agent reached here
+        lost = idx[~found]
+        self.has_target[lost] = False
+        self.update_target(lost)
+        return found
+
+    def get_shifted_positions(self, idx):
+        ''' Positions of members idx with the grids of the replicas laid side
+        by side, far enough apart that no range query crosses replicas '''
+        gap = self.width + EXPLORER_COMM_RANGE + 1
+        return np.stack([self.x[idx] + self.replica[idx] * gap, self.y[idx]], axis=1)
+
+    def borrow_energy(self, idx):
+        '''
+        Explorers idx borrow energy from the first exploiter around them, in
+        grid order, that agrees to share and has energy to spare. Returns the
+        mask of explorers that got energy
+        '''
+        success = np.zeros(len(idx), dtype=bool)
+        if not EXPLORERS_BORROW_ENERGY:
+            return success
+        donors = np.flatnonzero((self.kind == EXPLOITER) & (self.energy > THRESHOLD_EXPLOITER))
+        p_max = np.zeros(self.num_replicas)
+        np.maximum.at(p_max, self.replica[donors], self.energy_share_prob[donors])
+        # nobody shares in replicas without a willing exploiter
+        borrowers = np.flatnonzero(p_max[self.replica[idx]] > 0)
+        if len(borrowers) == 0:
+            return success
+
+        # explorers on the same cell see the same exploiters, so candidates are
+        # found once per pair of explorer cell and exploiter cell
+        cells, cell_of = np.unique(self.get_shifted_positions(idx[borrowers]), axis=0, return_inverse=True)
+        cell_of = cell_of.ravel()
+        donor_cells, donor_cell_of = np.unique(self.get_shifted_positions(donors), axis=0, return_inverse=True)
+        donors = donors[np.argsort(donor_cell_of.ravel(), kind="stable")]
+        donor_count = np.bincount(donor_cell_of.ravel(), minlength=len(donor_cells))
+        donor_start = np.cumsum(donor_count) - donor_count
+        i, k = CellList().get_pairs(cells, np.full(len(cells), ENERGY_TRANSMIT_RADIUS), donor_cells)
+        keep = np.abs(cells[i] - donor_cells[k]).max(axis=1) > 0
+        i, k = i[keep], k[keep]
+
+        # the candidates of a cell are the exploiters of its pairs laid end to
+        # end, pair_end holds where the candidates of each pair end
+        pair_end = np.cumsum(donor_count[k])
+        pair_begin = pair_end - donor_count[k]
+        first_pair = np.minimum(np.searchsorted(i, np.arange(len(cells))), max(len(i) - 1, 0))
+        start = pair_begin[first_pair] if len(i) > 0 else np.zeros(len(cells), dtype=int)
+        count = np.bincount(i, weights=donor_count[k], minlength=len(cells)).astype(int)
+
+        # walk the candidates of every explorer with geometric jumps at the
+        # highest share probability, and accept a candidate with its own
+        # probability relative to it, which finds the first agreeing exploiter
+        # without drawing a coin for each candidate
+        replica = self.replica[idx[borrowers]]
+        pos = np.full(len(borrowers), -1)
+        donor = np.full(len(borrowers), -1)
+        active = np.arange(len(borrowers))
+        while len(active) > 0:
+            pos[active] += self.draw(replica[active], lambda rng, r, n: rng.geometric(p_max[r], n))
+            active = active[pos[active] < count[cell_of[active]]]
+            g = start[cell_of[active]] + pos[active]
+            pair = np.searchsorted(pair_end, g, side="right")
+            candidate = donors[donor_start[k[pair]] + g - pair_begin[pair]]
+            agrees = self.draw(replica[active], uniform) * p_max[replica[active]] < self.energy_share_prob[candidate]
+            donor[active[agrees]] = candidate[agrees]
+            active = active[~agrees]
+
+        found = donor >= 0
+        self.energy[idx[borrowers[found]]] += EXPLORER_MINING_RATE
+        np.subtract.at(self.energy, donor[found], EXPLORER_MINING_RATE)
+        success[borrowers[found]] = True
+        return success
+
+    def sense(self):
+        ''' Every member records the resources within its sense range '''
+        h = self.history
+        t = self.num_rounds
+        if t == len(self.sense_times):
+            for name in h:
+                h[name] = np.concatenate([h[name], np.zeros_like(h[name])], axis=1)
+            self.sense_times = np.concatenate([self.sense_times, np.zeros_like(self.sense_times)])
+        for name, value in (("x", self.res_x), ("y", self.res_y), ("reserve", self.res_reserve), ("decay", self.res_decay)):
+            h[name][:, t] = value
+        self.sense_times[t] = self.schedule.time
+        self.num_rounds += 1
+
+        sense_range = np.where(self.kind == EXPLORER, EXPLORER_SENSE_RANGE, EXPLOITER_SENSE_RANGE)
+        dist = np.maximum(np.abs(self.x[:, None] - self.res_x[self.replica]), np.abs(self.y[:, None] - self.res_y[self.replica]))
+        seen = (dist <= sense_range[:, None]) & (dist > 0) & self.res_alive[self.replica]
+        self.memory[seen] = t
+
+        self.mem_sum += (self.memory >= 0).sum(axis=1)
+        self.mem_count += 1
+
+    def get_window_sums(self, cells, sender_cells, counts, freshest):
+        '''
+        For every cell of cells, the sum of counts over the sender cells in
+        communication range but not on that cell, and the max of freshest
+        over the sender cells in range including that cell. Cells are
+        shifted positions of one or more replicas, and pairs of cells are
+        enumerated with a cell list
+        '''
+        in_range = np.zeros((len(cells), counts.shape[1]), dtype=counts.dtype)
+        fresh = np.full(in_range.shape, -1, dtype=freshest.dtype)
+        cutoff = np.full(len(cells), EXPLORER_COMM_RANGE)
+        chunk = max(1, SENSE_BLOCK_SIZE // counts.shape[1])
+        for sources, rows, targets in CellList().iter_blocks(cells, cutoff, sender_cells):
+            # the pairs of a block are grouped by source, a source may span
+            # chunks but appears once in each
+            for start in range(0, len(rows), chunk):
+                r, k = rows[start:start + chunk], targets[start:start + chunk]
+                first = np.flatnonzero(np.diff(r, prepend=-1))
+                src = sources[r[first]]
+                in_range[src] += np.add.reduceat(counts[k], first)
+                fresh[src] = np.maximum(fresh[src], np.maximum.reduceat(freshest[k], first))
+
+        # partners on the member's own cell are out of reach. Both cell arrays
+        # come sorted from np.unique, so own cells are found by bisection
+        key = cells[:, 0] * self.height + cells[:, 1]
+        sender_key = sender_cells[:, 0] * self.height + sender_cells[:, 1]
+        own = np.minimum(np.searchsorted(sender_key, key), len(sender_key) - 1)
+        has_own = sender_key[own] == key
+        in_range[has_own] -= counts[own[has_own]]
+        return in_range, fresh
+
+    def get_grid_window_sums(self, cells, sender_cells, counts, freshest):
+        ''' get_window_sums for cells of a single replica, with window sums
+        over the whole grid, which is cheaper once the pairs of cells
+        outnumber the cells of the grid '''
+        gap = self.width + EXPLORER_COMM_RANGE + 1
+        x, y = cells[:, 0] % gap, cells[:, 1]
+        sx, sy = sender_cells[:, 0] % gap, sender_cells[:, 1]
+        grid = np.zeros((counts.shape[1], self.width, self.height), dtype=counts.dtype)
+        grid[:, sx, sy] = counts.T
+        in_range = (window_sum(grid, EXPLORER_COMM_RANGE)[:, x, y] - grid[:, x, y]).T
+        grid = np.full(grid.shape, -1, dtype=freshest.dtype)
+        grid[:, sx, sy] = freshest.T
+        return in_range, window_max(grid, EXPLORER_COMM_RANGE)[:, x, y].T
+
+    def communicate(self):
+        '''
+        Explorers share their memory with the members within their
+        communication range. A member that does not know a resource learns
+        it from k explorers in range that know it with probability
+        1 - (1 - p * coop)^k, and gets the freshest of their records
+        '''
+        senders = np.flatnonzero(self.kind == EXPLORER)
+        # only the resources some explorer knows of can be learnt
+        shared = np.flatnonzero((self.memory[senders] >= 0).any(axis=0))
+        if len(shared) == 0:
+            return
+        memory = self.memory[senders][:, shared]
+        known_by = np.zeros((self.num_replicas, len(shared)), dtype=bool)
+        np.logical_or.at(known_by, self.replica[senders], memory >= 0)
+
+        # explorers on one cell are in range of the same members, so they are
+        # counted per cell, and only pairs of cells are looked at
+        sender_cells, sender_cell_of = np.unique(self.get_shifted_positions(senders), axis=0, return_inverse=True)
+        sender_cell_of = sender_cell_of.ravel()
+        counts = np.zeros((len(sender_cells), len(shared)), dtype=np.int32)
+        np.add.at(counts, sender_cell_of, memory >= 0)
+        freshest = np.full(counts.shape, -1, dtype=np.int32)
+        np.maximum.at(freshest, sender_cell_of, memory)
+        cells, cell_of = np.unique(self.get_shifted_positions(np.arange(len(self.kind))), axis=0, return_inverse=True)
+        cell_of = cell_of.ravel()
+
+        # cells are in replica order, as shifted positions are
+        gap = self.width + EXPLORER_COMM_RANGE + 1
+        cell_end = np.cumsum(np.bincount(cells[:, 0] // gap, minlength=self.num_replicas))
+        sender_end = np.cumsum(np.bincount(sender_cells[:, 0] // gap, minlength=self.num_replicas))
+        num_cells = np.diff(cell_end, prepend=0)
+        num_sender_cells = np.diff(sender_end, prepend=0)
+        crowded = num_cells * num_sender_cells > self.width * self.height
+
+        in_range = np.zeros((len(cells), len(shared)), dtype=np.int32)
+        fresh = np.full(in_range.shape, -1, dtype=np.int32)
+        sparse = np.repeat(~crowded, num_cells)
+        sparse_senders = np.repeat(~crowded, num_sender_cells)
+        if sparse.any() and sparse_senders.any():
+            in_range[sparse], fresh[sparse] = self.get_window_sums(
+                cells[sparse], sender_cells[sparse_senders], counts[sparse_senders], freshest[sparse_senders])
+        for r in np.flatnonzero(crowded):
+            c = slice(cell_end[r] - num_cells[r], cell_end[r])
+            k = slice(sender_end[r] - num_sender_cells[r], sender_end[r])
+            in_range[c], fresh[c] = self.get_grid_window_sums(cells[c], sender_cells[k], counts[k], freshest[k])
+        in_range = in_range[cell_of]
+        freshest = fresh[cell_of]
+
+        p = np.where(self.kind == EXPLORER, INTRA_COMMUNICATION_PROB, INTER_COMMUNICATION_PROB) * self.share_probability[self.replica]
+        learn = 1 - (1 - p[:, None]) ** in_range
+        for r, (begin, end) in enumerate(zip(*self.get_blocks())):
+            cols = np.flatnonzero(known_by[r])
+            if begin == end or len(cols) == 0:
+                continue
+            memory = self.memory[begin:end, shared[cols]]
+            new = (memory < 0) & (self.replicas[r].rng.random(memory.shape) < learn[begin:end, cols])
+            memory[new] = freshest[begin:end, cols][new]
+            self.memory[begin:end, shared[cols]] = memory
+
+    def step_explorers(self):
+        idx = np.flatnonzero(self.kind == EXPLORER)
+        if self.schedule.time % BASE_RETURN_INTERVAL == 0:
+            self.is_returning_to_base[idx] = ~self.is_returning_to_base[idx]
+
+        at_target = self.has_target[idx] & (self.target_x[idx] == self.x[idx]) & (self.target_y[idx] == self.y[idx])
+        low = self.energy[idx] <= MINING_FACTOR * THRESHOLD_EXPLORER
+        returning = self.is_returning_to_base[idx]
+        mining = ~returning & self.mine_mode[idx]
+
+        # back at base, borrow energy from exploiters or head out again
+        borrow = idx[at_target & returning & low]
+        self.is_returning_to_base[borrow[~self.borrow_energy(borrow)]] = False
+        leave = idx[at_target & returning & ~low]
+        self.is_returning_to_base[leave] = False
+        self.drift[leave] = self.draw(self.replica[leave], lambda rng, r, n: rng.integers(0, len(DIRECTIONS), n))
+
+        # at a resource, mine it while energy is low
+        mine = idx[at_target & mining & low]
+        self.update_target(mine[~self.mine_energy(mine, EXPLORER_MINING_RATE)])
+        done = idx[at_target & mining & ~low]
+        self.mine_mode[done] = False
+        self.has_target[done] = False
+
+        exploring = idx[~self.mine_mode[idx]]
+        home = exploring[self.is_returning_to_base[exploring]]
+        self.update_target(home)
+        self.move_towards_target(home)
+        self.get_next_cell(exploring[~self.is_returning_to_base[exploring]])
+
+        mine = idx[self.mine_mode[idx]]
+        self.update_target(mine)
+        self.move_towards_target(mine[self.has_target[mine]])
+        self.get_next_cell(mine[~self.has_target[mine]])
+
+        self.energy[idx] -= self.living_cost[idx]
+        # when energy is low, switch to mining mode
+        switch = ~self.mine_mode[idx] & ~self.is_returning_to_base[idx] & (self.energy[idx] < THRESHOLD_EXPLORER)
+        self.mine_mode[idx[switch]] = True
+        self.age[idx] += 1
+
+    def step_exploiters(self):
+        idx = np.flatnonzero(self.kind == EXPLOITER)
+        self.age[idx] += 1
+
+        start = ~self.is_exploiting[idx] & (self.energy[idx] < THRESHOLD_EXPLOITER) & (self.memory[idx] >= 0).any(axis=1)
+        self.is_exploiting[idx[start]] = True
+
+        exploiting = idx[self.is_exploiting[idx]]
+        rest = idx[~self.is_exploiting[idx]]
+        self.exploit(exploiting)
+
+        # move randomly with small probability
+        moving = self.draw(self.replica[rest], uniform) < EXPLOITER_MOVE_PROB
+        self.move_randomly(rest[moving])
+        self.energy[rest[moving]] -= self.living_cost[rest[moving]]
+        self.energy[rest[~moving]] -= self.static_living_cost[rest[~moving]]
+
+    def exploit(self, idx):
+        ''' Exploiter.move for the exploiters idx '''
+        self.update_target(idx)
+
+        # target is not updated since no resources in memory
+        none = idx[~self.has_target[idx]]
+        self.set_base_target(none)
+        self.is_exploiting[none] = False
+
+        arrived = (self.target_x[idx] == self.x[idx]) & (self.target_y[idx] == self.y[idx])
+        going = idx[~arrived]
+        self.move_towards_target(going)
+        self.energy[going] -= self.living_cost[going]
+
+        # the branches are picked before any of them runs, so an exploiter
+        # arriving at base does not also mine or head back in the same tick
+        idx = idx[arrived]
+        at_base_mask = self.is_at_base[idx]
+        at_base = idx[at_base_mask]
+        self.is_at_base[at_base] = False
+        self.is_exploiting[at_base] = False
+        self.energy[at_base] -= self.static_living_cost[at_base]
+
+        idx = idx[~at_base_mask]
+        low = self.energy[idx] <= MINING_FACTOR * THRESHOLD_EXPLOITER
+        mine = idx[low]
+        lost = mine[~self.mine_energy(mine, EXPLOITER_MINING_RATE)]
+        # if no other target is found, go back to base
+        self.update_target(lost)
+        home = lost[~self.has_target[lost]]
+        self.set_base_target(home)
+        self.is_at_base[home] = True
+        self.energy[lost] -= self.static_living_cost[lost]
+
+        # sufficient energy has been restored, return to base
+        full = idx[~low]
+        self.set_base_target(full)
+        self.is_at_base[full] = True
+        self.energy[full] -= self.static_living_cost[full]
+
+    def reproduce(self):
+        ''' Members with enough energy produce a new member next to them, of
+        the same type with high probability '''
+        chance = self.draw(self.replica, uniform) < REPRODUCE_PROB
+        parents = np.flatnonzero((self.energy >= 2 * REPRODUCTION_ENERGY) & chance)
+        if len(parents) == 0:
+            return
+        self.energy[parents] -= REPRODUCTION_ENERGY
+        replica = self.replica[parents]
+        inherit = self.draw(replica, uniform) < INHERITANCE_PROB
+        kind = np.where(inherit, self.kind[parents], 1 - self.kind[parents])
+
+        # serial numbers continue from the count of agents of each replica
+        births = np.bincount(replica, minlength=self.num_replicas)
+        rank = np.arange(len(parents)) - np.searchsorted(replica, replica)
+        serial = np.array([rep.num_agents for rep in self.replicas])[replica] + 1 + rank
+        for rep, n in zip(self.replicas, births.tolist()):
+            rep.num_agents += n
+
+        # place the new agents in vicinity of the parents
+        x, y = self.random_neighbor(parents, BIRTH_DX, BIRTH_DY)
+        memory = self.memory[parents].copy() if INHERIT_MEMORY else None
+        self.add_members(replica, serial, kind, x, y, np.full(len(parents), 0.5), memory)
+
+    def bury(self):
+        ''' Record and remove the members that ran out of energy '''
+        dead = np.flatnonzero(self.energy <= 0)
+        if len(dead) == 0:
+            return
+        mem_len = self.mem_sum[dead] / np.maximum(self.mem_count[dead], 1)
+        replica = self.replica[dead]
+        for r, (begin, end) in enumerate(zip(np.searchsorted(replica, np.arange(self.num_replicas)),
+                                             np.searchsorted(replica, np.arange(self.num_replicas), side="right"))):
+            if begin == end:
+                continue
+            rep = self.replicas[r]
+            d = dead[begin:end]
+            rep.death_records.extend(unique_id=self.serial[d], type=self.kind[d], birth=self.birth[d],
+                                     death=np.full(len(d), self.schedule.time), age=self.age[d], mem_len=mem_len[begin:end])
+            explorers = int((self.kind[d] == EXPLORER).sum())
+            rep.num_explorers -= explorers
+            rep.num_exploiters -= len(d) - explorers
+        keep = np.ones(len(self.kind), dtype=bool)
+        keep[dead] = False
+        self.keep_members(keep)
+
+    def step_resources(self):
+        alive = self.res_alive
+        self.res_reserve[alive] -= self.res_decay[alive]
+        depleted = alive & (self.res_reserve <= 0)
+        # remove depleted energy reserves from the world and all memories
+        self.res_alive &= ~depleted
+        self.memory[depleted[self.replica]] = -1
+
+    def step(self):
+        # replicas whose population has died out are not simulated any more
+        population = np.bincount(self.replica, minlength=self.num_replicas) + self.res_alive.sum(axis=1)
+        running = np.flatnonzero(population > 0)
+
+        if self.schedule.time % SENSE_STEPS == 0:
+            self.sense()
+        if self.schedule.time % COMMUNICATION_STEPS == 0:
+            self.communicate()
+
+        self.resource_at = np.full((self.num_replicas, self.width, self.height), -1, dtype=int)
+        r, rid = np.nonzero(self.res_alive)
+        self.resource_at[r, self.res_x[r, rid], self.res_y[r, rid]] = rid
+
+        self.step_explorers()
+        self.step_exploiters()
+        if self.schedule.time % REPRODUCTION_STEPS == 0:
+            self.reproduce()
+        self.bury()
+        self.step_resources()
+        self.schedule.time += 1
+
+        for r in running.tolist():
+            rep = self.replicas[r]
+            rep.member_tracker.append((rep.num_explorers, rep.num_exploiters))
+
+            # keep track of total energy in world
+            if self.schedule.time % 50 == 0:
+                alive = self.res_alive[r]
+                if alive.any():
+                    mean_energy = np.mean(self.res_reserve[r, alive])
+                else:
+                    mean_energy = 0
+                rep.energy_tracker.append(mean_energy)
+
+            # change location of energy resources every 500 steps randomly
+            # and change decay_rate to opposite every 100 steps
+            if self.schedule.time % 50 == 0:
+                change = self.res_alive[r] & (rep.rng.random(RESERVE_SIZE) < 0.1)
+                self.res_decay[r, change] *= -1
+                if self.schedule.time % 500 == 0:
+                    n = int(change.sum())
+                    self.res_x[r, change] = rep.rng.integers(0, self.width, n)
+                    self.res_y[r, change] = rep.rng.integers(0, self.height, n)
+
+class ArrayWorld(ReplicaWorld):
+    '''
+    A single replica of the vectorized engine, with the constructor and the
+    outputs of World
+    '''
+    def __init__(self, N, coop, e_prob, width=100, height=100, seed=None):
+        super().__init__(N, [coop], [e_prob], [seed], width, height)
+
+    def __getattr__(self, name):
+        # parameters and logged outputs are those of the only replica
+        if name == "replicas":
+            raise AttributeError(name)
+        return getattr(self.replicas[0], name)
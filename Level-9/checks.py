@@ -0,0 +1,139 @@
+'''
+Consistency checks of the optimized code paths against the plain ones.
+Settings of config are changed for the duration of each check only.
+Run as python checks.py
+'''
+import itertools
+import numpy as np
+
+import agent
+import model
+
+from mesa.space import MultiGrid
+
+from array_model import ArrayWorld, EXPLOITER
+from memory import RecordSet, get_expected_energy
+from model import World
+from space import SparseMultiGrid
+
+def with_settings(modules, **settings):
+    ''' Set module level settings of each module, returning the old values '''
+    old = dict()
+    for m in modules:
+        for name, value in settings.items():
+            old[(m, name)] = getattr(m, name)
+            setattr(m, name, value)
+    return old
+
+def restore_settings(old):
+    for (m, name), value in old.items():
+        setattr(m, name, value)
+
+def check_inherited_capacity(steps=300):
+    '''
+    New born members inheriting a memory over their capacity evict records
+    as seen from their own cell, for every eviction policy and memory backend
+    '''
+    for policy, use_store in itertools.product(["oldest", "lowest_energy", "farthest"], [False, True]):
+        old = with_settings([agent, model], INHERIT_MEMORY=True, EVICTION_POLICY=policy,
+                            USE_KNOWLEDGE_STORE=use_store)
+        old_capacity = (agent.Explorer.memory_capacity, agent.Exploiter.memory_capacity)
+        agent.Explorer.memory_capacity, agent.Exploiter.memory_capacity = 8, 2
+        try:
+            world = World(100, 0.5, 0.5, seed=0)
+            for _ in range(steps):
+                world.step()
+                for a in world.get_members():
+                    assert len(a.memory) <= a.memory_capacity, (policy, use_store)
+            assert world.num_agents > 100, "no member was born"
+        finally:
+            agent.Explorer.memory_capacity, agent.Exploiter.memory_capacity = old_capacity
+            restore_settings(old)
+
+def check_kinetic_targets(num_queries=18000, seed=0):
+    '''
+    Greedy targets from RecordSet.get_best have the most expected energy of
+    all records, while records are written and removed between queries made
+    from a cell the querier stays on for a while before moving on
+    '''
+    rng = np.random.default_rng(seed)
+    records = RecordSet()
+    pos, time = (50, 50), 0
+    for _ in range(num_queries):
+        time += int(rng.integers(0, 3))
+        if rng.random() < 0.02:
+            pos = tuple(int(v) for v in rng.integers(0, 100, 2))
+        for _ in range(int(rng.integers(0, 3))):
+            dest = tuple(int(v) for v in rng.integers(0, 100, 2))
+            records[dest] = (dest, float(rng.uniform(0, 200)), float(rng.uniform(-0.1, 0.02)), time)
+        while len(records) > 64 or (len(records) > 1 and rng.random() < 0.2):
+            del records[list(records)[int(rng.integers(0, len(records)))]]
+        if len(records) == 0:
+            continue
+        positions, x, y, reserve, decay, obs_time = records.get_arrays()
+        expected = get_expected_energy(x, y, reserve, decay, obs_time, pos, time)
+        best = records.get_best(pos, time)
+        assert np.isclose(expected[positions.index(best)], expected.max()), (pos, time)
+        if records.kinetic is not None:
+            # replaced certificates do not pile up in the event heap
+            assert len(records.kinetic.events) <= 2 * records.kinetic.size + 1
+
+def check_exploiter_at_base(energy=30.0):
+    '''
+    An exploiting member arriving at its base target pays the static living
+    cost once and stops being at base, in ArrayWorld as in World, whatever
+    its energy
+    '''
+    world = World(20, 0.5, 0.5, seed=0)
+    world.step()
+    a = next(iter(world.exploiters.values()))
+    a.target, a.is_at_base, a.is_exploiting, a.energy, a.cost = a.pos, True, True, energy, 0
+    a.exploit()
+    expected = (a.energy - a.cost, a.is_at_base, a.is_exploiting)
+
+    array_world = ArrayWorld(20, 0.5, 0.5, seed=0)
+    array_world.step()
+    i = int(np.flatnonzero(array_world.kind == EXPLOITER)[0])
+    array_world.target_x[i], array_world.target_y[i] = array_world.x[i], array_world.y[i]
+    array_world.has_target[i] = array_world.is_at_base[i] = array_world.is_exploiting[i] = True
+    array_world.energy[i] = energy
+    array_world.static_living_cost[i] = a.static_living_cost
+    array_world.exploit(np.array([i]))
+    result = (array_world.energy[i], bool(array_world.is_at_base[i]), bool(array_world.is_exploiting[i]))
+    assert np.isclose(result[0], expected[0]) and result[1:] == expected[1:], (result, expected)
+
+class Token(object):
+    ''' Stand in for an agent on a grid '''
+    def __init__(self):
+        self.pos = None
+
+def check_sparse_grid(seed=0):
+    '''
+    SparseMultiGrid answers every form of indexing, neighborhood and
+    neighbors query the way MultiGrid does, and keeps a bounded number of
+    neighborhoods
+    '''
+    rng = np.random.default_rng(seed)
+    for torus in (False, True):
+        dense, sparse = MultiGrid(7, 5, torus), SparseMultiGrid(7, 5, torus)
+        sparse.neighborhoods.max_size = 16
+        for _ in range(12):
+            a, pos = Token(), tuple(int(v) for v in rng.integers(0, (7, 5)))
+            dense.place_agent(a, pos)
+            sparse.place_agent(a, pos)
+
+        indices = [3, -1, (2, 4), ((0, 0), (6, 4)), (slice(None), slice(None)),
+                   (1, slice(None)), (slice(2, 5), 3), (slice(None, None, 2), slice(1, 4))]
+        for index in indices:
+            assert dense[index] == sparse[index], (torus, index)
+        for x, y, moore, center, radius in itertools.product(range(7), range(5), (True, False), (True, False), (1, 2, 4)):
+            args = ((x, y), moore, center, radius)
+            assert list(dense.get_neighborhood(*args)) == list(sparse.get_neighborhood(*args)), (torus, args)
+            assert dense.get_neighbors(*args) == sparse.get_neighbors(*args), (torus, args)
+        assert len(sparse.neighborhoods.cache) <= 16
+
+if __name__ == "__main__":
+    for name, check in sorted(globals().items()):
+        if name.startswith("check_") and callable(check):
+            check()
+            print("%s passed" %(name))
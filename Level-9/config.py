@@ -64,8 +64,78 @@ BASE_RETURN_INTERVAL = 200
 BASE_RETURN_DEV = 50
 
 ENERGY_TRANSMIT_RADIUS = 8
+# let explorers back at base borrow energy from the exploiters around them.
+# In the original model borrowing never succeeded, as exploiters were looked
+# for among cell coordinates, so this is off to keep its results
+EXPLORERS_BORROW_ENERGY = False
 
 # for epsilon-greedy strategy
 EPSILON = 0.5
 
 DECAY_RATE_ADJUST = 0.5
+
+# side length (in cells) of the blocks used to index energy resource positions
+RESOURCE_BUCKET_SIZE = 16
+
+# sense for the whole population in one pass instead of in each agent's step
+BATCHED_SENSING = True
+# max number of member-resource distances computed at once while sensing
+SENSE_BLOCK_SIZE = 1000000
+
+# find communication partners for the whole population in one pass
+BATCHED_COMMUNICATION = True
+
+# reuse neighbor lists for sensing and communication until some agent has
+# moved more than half of the skin since they were built. Members move a cell
+# per tick and lists are queried every SENSE_STEPS ticks, so any skin that
+# lets a list be reused widens the cutoff so much that filtering the extra
+# candidate pairs costs more than the plain cell list, hence off by default
+USE_VERLET_LISTS = False
+VERLET_SKIN = 20
+
+# max number of neighborhoods kept in the neighborhood cache
+NEIGHBORHOOD_CACHE_SIZE = 50000
+
+# keep the memories of all members in one array backed knowledge store
+USE_KNOWLEDGE_STORE = False
+# number of member slots the knowledge store is allocated with
+KNOWLEDGE_STORE_SLOTS = 256
+
+# share knowledge store records by OR-ing packed bitsets of known resources
+BITSET_SHARING = True
+
+# max number of energy resources an agent remembers, None for no limit
+EXPLORER_MEMORY_CAPACITY = None
+EXPLOITER_MEMORY_CAPACITY = None
+# record evicted from a full memory: "oldest" observation, "lowest_energy"
+# expected by the target selection criteria, or "farthest" from the agent
+EVICTION_POLICY = "oldest"
+
+# whether new born agents start out with the memory of their parent
+INHERIT_MEMORY = False
+
+# answer greedy target queries repeated from the same cell from a kinetic
+# tournament kept per memory
+KINETIC_TARGETS = False
+
+# draw explorer drift moves from blocks of uniforms mapped through the drift tables
+BATCHED_SAMPLING = True
+# number of draws pre-generated at a time for each random pool of the sampler
+SAMPLER_BLOCK_SIZE = 4096
+# number of draws pre-generated at a time for the random stream of each member
+AGENT_SAMPLER_BLOCK_SIZE = 64
+# pools of a sampler start at this many draws, and double on each refill up to
+# its block size
+FIRST_SAMPLER_BLOCK_SIZE = 4
+
+# run a tick as phases over the whole population (sense, communicate, move,
+# metabolize, lifecycle) instead of one full step per agent in random order
+STAGED_ACTIVATION = True
+
+# number of death records a world is allocated with, the record arrays grow
+# by doubling past it
+DEATH_RECORDS_CAPACITY = 1024
+
+# store only the occupied cells of the grid and of the occupancy counts, so
+# that worlds far larger than the population can be built and simulated
+SPARSE_GRID = False
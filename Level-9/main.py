@@ -3,13 +3,43 @@ import argparse
 
 from server import server
 from model import World
+from array_model import ArrayWorld, ReplicaWorld
+from registry import AgentType
 
-def main():
-    # constants specific to statistic collection of simulations
-    NUM_SIMULATIONS = 4
+# constants specific to statistic collection of simulations
+NUM_SIMULATIONS = 4
+# every simulation is seeded from its cooperation level and index, so
+# runs do not depend on the order or process they are run in
+SEED = 0
+
+def write_log(f, model):
+    ''' Write the statistics of one simulation to the log file f '''
+    records = model.death_records
+    # explorer mean age
+    mean_explorer_age = records.mean("age", AgentType.EXPLORER)
+    # exploiter mean age
+    mean_exploiter_age = records.mean("age", AgentType.EXPLOITER)
+    # entire population mean age
+    mean_age = records.mean("age")
+    # mean expected age based on initial values
+    expected_age = np.mean(model.expected_ages)
+    ages = ', '.join(records.get("age").astype(str))
+    total_energy = ', '.join([str(i) for i in model.energy_tracker])
+    num_explorers = ', '.join([str(i[0]) for i in model.member_tracker])
+    num_exploiters = ', '.join([str(i[1]) for i in model.member_tracker])
 
+    f.write("ages, " + ages + "\n")
+    f.write("total_energy, " + total_energy + "\n")
+    f.write("num_explorers, " + num_explorers + "\n")
+    f.write("num_exploiters, " + num_exploiters + "\n")
+    f.write("%.5f, %.5f, %.5f, %.5f\n" %(mean_explorer_age, mean_exploiter_age, mean_age, expected_age))
+
+def main():
     parser = argparse.ArgumentParser(description="Visualization controls")
     parser.add_argument("--visualize",  action="store_true", help="whether to visualize on browser")
+    parser.add_argument("--engine", choices=["object", "array", "batched"], default="object",
+                        help="simulate with mesa agents, with the vectorized array engine, "
+                             "or with all simulations of the sweep batched in one array engine")
     args = parser.parse_args()
 
     if args.visualize:
@@ -23,34 +53,33 @@ def main():
         #############
 
         e_prob = 0.5
+        if args.engine == "batched":
+            print("Simulating %d cooperation levels at once" %(len(coops)))
+            runs = [(coop, i) for coop in coops for i in range(NUM_SIMULATIONS)]
+            model = ReplicaWorld(100, [coop for coop, _ in runs], [e_prob] * len(runs),
+                                 [[SEED, int(coop * 100), i] for coop, i in runs])
+            while model.schedule.time < 3000 and model.schedule.get_agent_count() != 0:
+                # simulate till there are agents in any of the worlds
+                model.step()
+
+            for k, coop in enumerate(coops):
+                f_name = "logs/log_%d" %(coop * 100)
+                with open(f_name, 'w+') as f:
+                    for replica in model.replicas[k * NUM_SIMULATIONS:(k + 1) * NUM_SIMULATIONS]:
+                        write_log(f, replica)
+            return
+
+        engine = World if args.engine == "object" else ArrayWorld
         for coop in coops:
             print("Simulating with cooperation level %.2f" %(coop))
             f_name = "logs/log_%d" %(coop * 100)
             with open(f_name, 'w+') as f:
-                for _ in range(NUM_SIMULATIONS):
-                    model = World(100, coop, e_prob)
-                    while model.schedule.time < 3000 and len(model.schedule.agents) != 0:
+                for i in range(NUM_SIMULATIONS):
+                    model = engine(100, coop, e_prob, seed=[SEED, int(coop * 100), i])
+                    while model.schedule.time < 3000 and model.schedule.get_agent_count() != 0:
                         # simulate till there are agents in the world
                         model.step()
-
-                    # explorer mean age
-                    mean_explorer_age = np.mean([i[1] for i in model.ages if "explorer" in i[0]])
-                    # exploiter mean age
-                    mean_exploiter_age = np.mean([i[1] for i in model.ages if "exploiter" in i[0]])
-                    # entire population mean age
-                    mean_age = np.mean([i[1] for i in model.ages])
-                    # mean expected age based on initial values
-                    expected_age = np.mean(model.expected_ages)
-                    ages = ', '.join([str(i[1]) for i in model.ages])
-                    total_energy = ', '.join([str(i) for i in model.energy_tracker])
-                    num_explorers = ', '.join([str(i[0]) for i in model.member_tracker])
-                    num_exploiters = ', '.join([str(i[1]) for i in model.member_tracker])
-
-                    f.write("ages, " + ages + "\n")
-                    f.write("total_energy, " + total_energy + "\n")
-                    f.write("num_explorers, " + num_explorers + "\n")
-                    f.write("num_exploiters, " + num_exploiters + "\n")
-                    f.write("%.5f, %.5f, %.5f, %.5f\n" %(mean_explorer_age, mean_exploiter_age, mean_age, expected_age))
+                    write_log(f, model)
 
 if __name__ == "__main__":
     main()
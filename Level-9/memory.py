@@ -0,0 +1,617 @@
+import numpy as np
+import heapq
+
+from config import *
+
+def pack_bits(mask):
+    ''' Pack a boolean array along its last axis into 64 bit words '''
+    n = mask.shape[-1]
+    padded = np.zeros(mask.shape[:-1] + (-(-n // 64) * 64,), dtype=bool)
+    padded[..., :n] = mask
+    return np.packbits(padded, axis=-1, bitorder="little").view(np.uint64)
+
+def unpack_bits(words, n):
+    ''' Inverse of pack_bits for a boolean array of last dimension n '''
+    return np.unpackbits(words.view(np.uint8), axis=-1, bitorder="little")[..., :n].astype(bool)
+
+def expected_energy(record, pos, time):
+    ''' Amount of energy an agent at pos expects to find at a remembered resource '''
+    dest, reserve_size, decay, obs_time = record
+    d = max(dest[0] - pos[0], dest[1] - pos[1])
+    reserve_size = reserve_size - (time - obs_time) * decay
+    expected_energy = reserve_size - d * decay
+    if expected_energy < 0:
+        return 0
+    return expected_energy
+
+def get_expected_energy(x, y, reserve, decay, obs_time, pos, time):
+    ''' expected_energy over arrays of remembered resources '''
+    d = np.maximum(x - pos[0], y - pos[1])
+    reserve = reserve - (time - obs_time) * decay
+    return np.maximum(reserve - d * decay, 0)
+
+def sample_index(weights, u):
+    '''
+    Map a uniform draw u to an index drawn with probability proportional to
+    weights, the same way np.random.choice(len(weights), p=...) does
+    '''
+    cdf = np.cumsum(weights)
+    return int(np.searchsorted(cdf / cdf[-1], u, side="right"))
+
+def draw_index(owner, weights):
+    ''' Weighted draw from the random stream of a memory's owner '''
+    return sample_index(weights, owner.sampler.uniform())
+
+def draw_uniforms(owner, size):
+    ''' Uniforms from the random stream of a memory's owner '''
+    return owner.sampler.random(size)
+
+def eviction_key(record, pos, time, policy):
+    ''' Records with the lowest key are evicted first from a full memory '''
+    if policy == "oldest":
+        return record[3]
+    elif policy == "lowest_energy":
+        return expected_energy(record, pos, time)
+    elif policy == "farthest":
+        return -max(abs(record[0][0] - pos[0]), abs(record[0][1] - pos[1]))
+    raise ValueError("Unknown eviction policy %s" %(policy))
+
+def get_eviction_keys(x, y, reserve, decay, obs_time, pos, time, policy):
+    ''' eviction_key over arrays of remembered resources '''
+    if policy == "oldest":
+        return obs_time
+    elif policy == "lowest_energy":
+        return get_expected_energy(x, y, reserve, decay, obs_time, pos, time)
+    elif policy == "farthest":
+        return -np.maximum(np.abs(x - pos[0]), np.abs(y - pos[1]))
+    raise ValueError("Unknown eviction policy %s" %(policy))
+
+class HolderIndex(object):
+    ''' Reverse index from the position of an energy resource to the record
+    sets of the memories which remember it, so that a depleted resource is
+    purged only from the memories actually holding it '''
+    def __init__(self):
+        self.holders = dict()
+
+    def add(self, pos, records):
+        # dicts are used as insertion ordered sets
+        self.holders.setdefault(pos, dict())[records] = None
+
+    def discard(self, pos, records):
+        holders = self.holders.get(pos)
+        if holders is None:
+            return
+        holders.pop(records, None)
+        if len(holders) == 0:
+            del self.holders[pos]
+
+    def pop(self, pos):
+        ''' Return the record sets holding pos, and forget all of them '''
+        return list(self.holders.pop(pos, ()))
+
+class KineticTournament(object):
+    ''' Kinetic tournament tree over the expected energy of the records of
+    a memory, seen from a fixed position. Without the clamp at zero, the
+    expected energy of a record is a line in time with slope -decay, so the
+    winner of each node only changes at a predictable crossover time. Those
+    certificate failures are kept in a heap and processed as time advances,
+    which keeps the best record up to date in O(log M) per event or change.
+    Ties are won by the record added to memory first, as with np.argmax '''
+    def __init__(self, records, pos, time):
+        self.pos = pos
+        self.time = time
+        self.next_order = 0
+        self.build(list(records.values()), max(1, len(records)))
+
+    def build(self, records, capacity):
+        size = 1
+        while size < capacity:
+            size *= 2
+        self.size = size
+        self.keys = [None] * size
+        self.a = [0.0] * size
+        self.b = [0.0] * size
+        self.order = [0] * size
+        self.leaf_of = dict()
+        self.free = list(range(size - 1, -1, -1))
+        self.winner = [-1] * (2 * size)
+        self.stamp = [0] * (2 * size)
+        self.events = []
+
+        for r in records:
+            self.set_leaf(r, self.next_order, update=False)
+            self.next_order += 1
+        for node in range(size - 1, 0, -1):
+            self.recompute(node)
+
+    def value(self, i, t):
+        return self.a[i] - self.b[i] * t
+
+    def beats(self, i, j, t):
+        vi, vj = self.value(i, t), self.value(j, t)
+        return vi > vj or (vi == vj and self.order[i] < self.order[j])
+
+    def failure_time(self, w, l, t):
+        ''' First tick after t at which loser l may overtake winner w '''
+        da = self.a[l] - self.a[w]
+        db = self.b[l] - self.b[w]
+        if db >= 0:
+            # the loser's line never rises above the winner's
+            return None
+        return max(t + 1, int(np.ceil(da / db - 1e-9)))
+
+    def recompute(self, node):
+        t = self.time
+        l, r = self.winner[2 * node], self.winner[2 * node + 1]
+        if l == -1 or r == -1:
+            w, loser = max(l, r), -1
+        elif self.beats(l, r, t):
+            w, loser = l, r
+        else:
+            w, loser = r, l
+        self.winner[node] = w
+        self.stamp[node] += 1
+        if loser != -1:
+            fail = self.failure_time(w, loser, t)
+            if fail is not None:
+                heapq.heappush(self.events, (fail, node, self.stamp[node]))
+                if len(self.events) > 2 * self.size:
+                    self.compact()
+
+    def compact(self):
+        ''' Drop the events of certificates which have since been replaced,
+        leaving at most one per node '''
+        self.events = [e for e in self.events if e[2] == self.stamp[e[1]]]
+        heapq.heapify(self.events)
+
+    def propagate(self, node):
+        while node >= 1:
+            self.recompute(node)
+            node //= 2
+
+    def set_leaf(self, record, order, update=True):
+        dest, reserve_size, decay, obs_time = record
+        key = dest
+        leaf = self.leaf_of.get(key)
+        if leaf is None:
+            if len(self.free) == 0:
+                self.grow()
+            leaf = self.free.pop()
+            self.leaf_of[key] = leaf
+        d = max(dest[0] - self.pos[0], dest[1] - self.pos[1])
+        self.keys[leaf] = key
+        self.a[leaf] = reserve_size + obs_time * decay - d * decay
+        self.b[leaf] = decay
+        self.order[leaf] = order
+        self.winner[self.size + leaf] = leaf
+        if update:
+            self.propagate((self.size + leaf) // 2)
+
+    def grow(self):
+        state = [(self.keys[i], self.a[i], self.b[i], self.order[i]) for i in self.leaf_of.values()]
+        size = 2 * self.size
+        self.size = size
+        self.keys = [None] * size
+        self.a = [0.0] * size
+        self.b = [0.0] * size
+        self.order = [0] * size
+        self.leaf_of = dict()
+        self.winner = [-1] * (2 * size)
+        self.stamp = [0] * (2 * size)
+        self.events = []
+        for leaf, (key, a, b, order) in enumerate(state):
+            self.keys[leaf], self.a[leaf], self.b[leaf], self.order[leaf] = key, a, b, order
+            self.leaf_of[key] = leaf
+            self.winner[size + leaf] = leaf
+        self.free = list(range(size - 1, len(state) - 1, -1))
+        for node in range(size - 1, 0, -1):
+            self.recompute(node)
+
+    def on_set(self, record, is_new):
+        order = self.order[self.leaf_of[record[0]]] if not is_new else self.next_order
+        if is_new:
+            self.next_order += 1
+        self.set_leaf(record, order)
+
+    def on_remove(self, pos):
+        leaf = self.leaf_of.pop(pos)
+        self.keys[leaf] = None
+        self.winner[self.size + leaf] = -1
+        self.free.append(leaf)
+        self.propagate((self.size + leaf) // 2)
+
+    def advance(self, t):
+        self.time = t
+        while len(self.events) > 0 and self.events[0][0] <= t:
+            _, node, stamp = heapq.heappop(self.events)
+            if stamp == self.stamp[node]:
+                self.propagate(node)
+
+    def get_best(self, t):
+        ''' Return the key of the best record at time t, and its value '''
+        self.advance(t)
+        w = self.winner[1]
+        if w == -1:
+            return None, 0
+        return self.keys[w], self.value(w, t)
+
+class RecordSet(dict):
+    ''' Records of a memory keyed by position. A record set can be shared
+    by several memories, and is copied by the first of them to write to it.
+    The records are also kept as arrays for target scoring, rebuilt on the
+    first read after a write, and optionally in a kinetic tournament for
+    greedy target queries made twice in a row from the same cell '''
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.num_sharers = 1
+        self.arrays = None
+        self.kinetic = None
+        self.query_pos = None
+
+    def __setitem__(self, pos, record):
+        self.arrays = None
+        if self.kinetic is not None:
+            self.kinetic.on_set(record, pos not in self)
+        super().__setitem__(pos, record)
+
+    def __delitem__(self, pos):
+        self.arrays = None
+        if self.kinetic is not None:
+            self.kinetic.on_remove(pos)
+        super().__delitem__(pos)
+
+    def pop(self, pos, *default):
+        self.arrays = None
+        if self.kinetic is not None and pos in self:
+            self.kinetic.on_remove(pos)
+        return super().pop(pos, *default)
+
+    def get_best(self, pos, time):
+        ''' Return the position of the record with most expected energy '''
+        if self.kinetic is None or self.kinetic.pos != pos:
+            if self.query_pos != pos:
+                # the distance term of every record changes with the position,
+                # so a moving querier is answered by scanning the records
+                self.kinetic = None
+                self.query_pos = pos
+                positions, x, y, reserve, decay, obs_time = self.get_arrays()
+                return positions[np.argmax(get_expected_energy(x, y, reserve, decay, obs_time, pos, time))]
+            # a querier staying put, like an exploiter waiting at a base or
+            # resource, keeps asking from the same cell
+            self.kinetic = KineticTournament(self, pos, time)
+        best, value = self.kinetic.get_best(time)
+        if value <= 0:
+            # expected energies are clamped at zero, where the first wins
+            return next(iter(self))
+        return best
+
+    def get_arrays(self):
+        ''' Return positions, and x, y, reserve, decay, obs_time arrays '''
+        if self.arrays is None:
+            positions = list(self.keys())
+            cols = np.array([(p[0], p[1], r[1], r[2], r[3]) for p, r in self.items()], dtype=float)
+            self.arrays = (positions,) + tuple(cols.reshape(-1, 5).T)
+        return self.arrays
+
+    # record sets are indexed by identity, not by content
+    __hash__ = object.__hash__
+    __eq__ = object.__eq__
+
+class Memory(object):
+    ''' Energy resources remembered by an agent, keyed by position. Each
+    record is a (pos, reserve, decay_rate, obs_time) tuple, and iteration
+    yields records in the order their positions were first added. When a
+    HolderIndex is given, the record set is registered under every position
+    in memory. Once capacity records are held, adding a new position evicts
+    a record chosen by the eviction policy.
+
+    Offspring inherit memory in constant time by sharing the parent's record
+    set. Whichever of them writes first takes its own copy, so updates never
+    leak between parent and child '''
+    def __init__(self, owner, holders=None, capacity=None, policy=EVICTION_POLICY):
+        self.owner = owner
+        self.holders = holders
+        self.capacity = capacity
+        self.policy = policy
+        self.num_evictions = 0
+        self.records = RecordSet()
+
+    def __len__(self):
+        return len(self.records)
+
+    def __contains__(self, pos):
+        return pos in self.records
+
+    def __iter__(self):
+        return iter(self.records.values())
+
+    def get(self, pos):
+        return self.records.get(pos)
+
+    def own(self):
+        ''' Make sure the record set is not shared before writing to it '''
+        if self.records.num_sharers == 1:
+            return
+        self.records.num_sharers -= 1
+        self.records = RecordSet(self.records)
+        if self.holders is not None:
+            for pos in self.records:
+                self.holders.add(pos, self.records)
+
+    def add(self, record):
+        ''' Add a record, replacing any older record of the same position '''
+        self.own()
+        pos = record[0]
+        if pos not in self.records:
+            if self.capacity is not None and len(self.records) >= self.capacity:
+                self.evict()
+            if self.holders is not None:
+                self.holders.add(pos, self.records)
+        self.records[pos] = record
+
+    def evict(self):
+        time = self.owner.model.schedule.time
+        victim = min(self.records.values(), key=lambda r: eviction_key(r, self.owner.pos, time, self.policy))
+        self.remove(victim[0])
+        self.num_evictions += 1
+
+    def enforce_capacity(self):
+        ''' Evict records until at most capacity are held '''
+        while self.capacity is not None and len(self.records) > self.capacity:
+            self.evict()
+
+    def remove(self, pos):
+        self.own()
+        record = self.records.pop(pos, None)
+        if self.holders is not None and record is not None:
+            self.holders.discard(pos, self.records)
+        return record
+
+    def clear(self):
+        if self.records.num_sharers > 1:
+            # leave the shared records to the other memories
+            self.records.num_sharers -= 1
+        elif self.holders is not None:
+            for pos in self.records:
+                self.holders.discard(pos, self.records)
+        self.records = RecordSet()
+
+    def inherit(self, parent):
+        ''' Start out with the records of the parent's memory. Capacity is
+        enforced by the owner once it has been placed '''
+        self.clear()
+        self.records = parent.records
+        self.records.num_sharers += 1
+
+    def move_to_end(self, pos):
+        self.own()
+        self.records[pos] = self.records.pop(pos)
+
+    def select_target(self, pos, time, greedy):
+        '''
+        Pick a target by the amount of energy expected at the destination,
+        either greedily or with probability increasing with expected energy
+        '''
+        if greedy and KINETIC_TARGETS:
+            return self.records.get_best(pos, time)
+        positions, x, y, reserve, decay, obs_time = self.records.get_arrays()
+        expected = get_expected_energy(x, y, reserve, decay, obs_time, pos, time)
+        if greedy:
+            return positions[np.argmax(expected)]
+        return positions[draw_index(self.owner, expected + 1)]
+
+    def observe(self, resources, time):
+        for e in resources:
+            # add new energy resource, or update the reserve and decay rate
+            # of a known one
+            self.add((e.pos, e.reserve, e.decay_rate, time))
+
+    def share(self, other, share_probability):
+        ''' Copy each record unknown to other memory with share_probability '''
+        draws = draw_uniforms(self.owner, len(self.records))
+        for m, u in zip(list(self.records.values()), draws):
+            if u < share_probability and m[0] not in other:
+                other.add(m)
+
+class KnowledgeStore(object):
+    ''' What every member knows about the energy resources, held as arrays
+    with one row per member slot and one column per resource id. Each known
+    resource takes a few bytes across the arrays instead of a tuple of
+    Python objects, and memory operations become masked array operations.
+    The valid mask is mirrored as packed bitsets for bitset sharing '''
+    def __init__(self, num_resources, num_slots=KNOWLEDGE_STORE_SLOTS):
+        self.num_resources = num_resources
+        self.valid = np.zeros((0, num_resources), dtype=bool)
+        self.bits = pack_bits(self.valid)
+        self.x = np.zeros((0, num_resources), dtype=np.int32)
+        self.y = np.zeros((0, num_resources), dtype=np.int32)
+        self.reserve = np.zeros((0, num_resources), dtype=np.float32)
+        self.decay = np.zeros((0, num_resources), dtype=np.float32)
+        self.obs_time = np.zeros((0, num_resources), dtype=np.int32)
+        # records are iterated in the order given by this counter
+        self.order = np.zeros((0, num_resources), dtype=np.int64)
+        self.counter = 0
+        # ids of the resources any record has placed at a position, so that
+        # looking a position up only checks those columns of a row
+        self.rids_at = dict()
+        self.free_slots = []
+        self.grow(num_slots)
+
+    def grow(self, num_slots):
+        old = len(self.valid)
+        pad = ((0, num_slots - old), (0, 0))
+        for name in ("valid", "x", "y", "reserve", "decay", "obs_time", "order"):
+            setattr(self, name, np.pad(getattr(self, name), pad))
+        self.bits = pack_bits(self.valid)
+        # hand out lower slots first
+        self.free_slots.extend(range(num_slots - 1, old - 1, -1))
+
+    def allocate(self):
+        if len(self.free_slots) == 0:
+            self.grow(2 * len(self.valid))
+        return self.free_slots.pop()
+
+    def release(self, slot):
+        self.valid[slot] = False
+        self.bits[slot] = 0
+        self.free_slots.append(slot)
+
+    def next_order(self, n):
+        order = np.arange(self.counter, self.counter + n)
+        self.counter += n
+        return order
+
+    def observe(self, slots, rids, x, y, reserve, decay, time):
+        '''
+        Write observations of resources rids by members in slots. Positions
+        observed for the first time go to the back of the iteration order
+        '''
+        new = ~self.valid[slots, rids]
+        self.order[slots[new], rids[new]] = self.next_order(int(new.sum()))
+        for rid, px, py in set(zip(np.asarray(rids).tolist(), np.asarray(x).tolist(), np.asarray(y).tolist())):
+            self.rids_at.setdefault((px, py), set()).add(rid)
+        self.valid[slots, rids] = True
+        self.update_bits(np.unique(slots))
+        self.x[slots, rids] = x
+        self.y[slots, rids] = y
+        self.reserve[slots, rids] = reserve
+        self.decay[slots, rids] = decay
+        self.obs_time[slots, rids] = time
+
+    def update_bits(self, slots):
+        self.bits[slots] = pack_bits(self.valid[slots])
+
+    def count(self, slots):
+        return self.valid[slots].sum(axis=1)
+
+    def purge(self, rid):
+        self.valid[:, rid] = False
+        self.bits[:, rid // 64] &= ~(np.uint64(1) << np.uint64(rid % 64))
+
+class StoreMemory(object):
+    ''' Memory of a single member backed by its row of a KnowledgeStore,
+    bounded to capacity records in the same way as Memory '''
+    def __init__(self, store, owner, capacity=None, policy=EVICTION_POLICY):
+        self.store = store
+        self.slot = store.allocate()
+        self.owner = owner
+        self.capacity = capacity
+        self.policy = policy
+        self.num_evictions = 0
+
+    def get_known(self):
+        ''' Return the known resource ids in iteration order '''
+        store = self.store
+        rids = np.flatnonzero(store.valid[self.slot])
+        return rids[np.argsort(store.order[self.slot, rids], kind="stable")]
+
+    def find(self, pos):
+        store = self.store
+        row = self.slot
+        rids = np.array(sorted(store.rids_at.get(pos, ())), dtype=int)
+        return rids[store.valid[row, rids] & (store.x[row, rids] == pos[0]) & (store.y[row, rids] == pos[1])]
+
+    def __len__(self):
+        return int(self.store.valid[self.slot].sum())
+
+    def __contains__(self, pos):
+        return len(self.find(pos)) > 0
+
+    def __iter__(self):
+        store = self.store
+        row = self.slot
+        for rid in self.get_known():
+            yield ((int(store.x[row, rid]), int(store.y[row, rid])), float(store.reserve[row, rid]),
+                   float(store.decay[row, rid]), int(store.obs_time[row, rid]))
+
+    def remove(self, pos):
+        self.store.valid[self.slot, self.find(pos)] = False
+        self.store.update_bits([self.slot])
+
+    def move_to_end(self, pos):
+        rids = self.find(pos)
+        self.store.order[self.slot, rids] = self.store.next_order(len(rids))
+
+    def clear(self):
+        self.store.release(self.slot)
+
+    def inherit(self, parent):
+        ''' Start out with a copy of the parent's row of the store. Capacity is
+        enforced by the owner once it has been placed '''
+        store = self.store
+        for name in ("valid", "x", "y", "reserve", "decay", "obs_time", "order"):
+            arr = getattr(store, name)
+            arr[self.slot] = arr[parent.slot]
+        store.update_bits([self.slot])
+
+    def get_arrays(self, rids):
+        store = self.store
+        row = self.slot
+        return (store.x[row, rids], store.y[row, rids], store.reserve[row, rids],
+                store.decay[row, rids], store.obs_time[row, rids])
+
+    def enforce_capacity(self):
+        ''' Evict records until at most capacity are held '''
+        if self.capacity is None:
+            return
+        rids = self.get_known()
+        excess = len(rids) - self.capacity
+        if excess <= 0:
+            return
+        keys = get_eviction_keys(*self.get_arrays(rids), self.owner.pos,
+                                 self.owner.model.schedule.time, self.policy)
+        victims = rids[np.argsort(keys, kind="stable")[:excess]]
+        self.store.valid[self.slot, victims] = False
+        self.store.update_bits([self.slot])
+        self.num_evictions += excess
+
+    def observe(self, resources, time):
+        if len(resources) == 0:
+            return
+        n = len(resources)
+        self.store.observe(np.full(n, self.slot), np.array([e.rid for e in resources]),
+                           [e.pos[0] for e in resources], [e.pos[1] for e in resources],
+                           [e.reserve for e in resources], [e.decay_rate for e in resources], time)
+        self.enforce_capacity()
+
+    def share(self, other, share_probability):
+        ''' Copy each record unknown to other memory with share_probability '''
+        store = self.store
+        src, dst = self.slot, other.slot
+        if BITSET_SHARING:
+            # OR the receiver's bitset with a Bernoulli masked copy of the
+            # sender's, then bring over the records of the new bits
+            mask = pack_bits(draw_uniforms(self.owner, store.num_resources) < share_probability)
+            new = store.bits[src] & mask & ~store.bits[dst]
+            if not new.any():
+                return
+            store.bits[dst] |= new
+            take = np.flatnonzero(unpack_bits(new, store.num_resources))
+            take = take[np.argsort(store.order[src, take], kind="stable")]
+        else:
+            known = self.get_known()
+            take = known[(draw_uniforms(self.owner, len(known)) < share_probability) & ~store.valid[dst, known]]
+            store.valid[dst, take] = True
+            store.update_bits([dst])
+
+        for name in ("x", "y", "reserve", "decay", "obs_time"):
+            arr = getattr(store, name)
+            arr[dst, take] = arr[src, take]
+        store.valid[dst, take] = True
+        store.order[dst, take] = store.next_order(len(take))
+        other.enforce_capacity()
+
+    def select_target(self, pos, time, greedy):
+        '''
+        Pick a target by the amount of energy expected at the destination,
+        either greedily or with probability increasing with expected energy
+        '''
+        rids = self.get_known()
+        x, y, reserve, decay, obs_time = self.get_arrays(rids)
+        expected = get_expected_energy(x, y, reserve, decay, obs_time, pos, time)
+
+        if greedy:
+            idx = np.argmax(expected)
+        else:
+            idx = draw_index(self.owner, expected + 1)
+        return (int(x[idx]), int(y[idx]))
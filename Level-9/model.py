@@ -1,82 +1,267 @@
 import numpy as np
+import random
 import matplotlib.pyplot as plt
 
 from mesa import Model
-from mesa.space import MultiGrid
 from mesa.time import RandomActivation
 from mesa.datacollection import DataCollector
 
 from config import *
 from agent import *
+from space import *
+from memory import *
+from rng import *
+from schedule import *
 
 class World(Model):
-    def __init__(self, N, coop, e_prob, width=100, height=100):
+    def __new__(cls, *args, **kwargs):
+        # seed may be any entropy numpy accepts, which is more than mesa's
+        # own seeding of the schedule does, so it is left to __init__
+        kwargs.pop("seed", None)
+        return super().__new__(cls, *args, **kwargs)
+
+    def __init__(self, N, coop, e_prob, width=100, height=100, seed=None):
+        # every random draw of the run comes from a stream derived from seed
+        self.streams = Streams(seed)
+        self.seed = self.streams.seed
+        self.setup_rng = self.streams.get_generator(SETUP_STREAM)
+        self.random = random.Random(self.streams.get_int_seed(SCHEDULE_STREAM))
+        self.sampler = self.streams.get_sampler(RELOCATION_STREAM)
+
         self.num_agents = N
-        self.grid = MultiGrid(width, height, False)
-        self.schedule = RandomActivation(self)
+        if SPARSE_GRID:
+            self.grid = TrackedSparseGrid(width, height, False)
+        else:
+            self.grid = TrackedMultiGrid(width, height, False)
+        if STAGED_ACTIVATION:
+            self.schedule = PhasedActivation(self)
+        else:
+            self.schedule = RandomActivation(self)
         self.running = True
-        self.population_center_x = np.random.randint(POP_MARGIN, self.grid.width - POP_MARGIN)
-        self.population_center_y = np.random.randint(POP_MARGIN, self.grid.height - POP_MARGIN)
+        self.population_center_x = int(self.setup_rng.integers(POP_MARGIN, self.grid.width - POP_MARGIN))
+        self.population_center_y = int(self.setup_rng.integers(POP_MARGIN, self.grid.height - POP_MARGIN))
         self.num_energy_resources = RESERVE_SIZE
         self.num_explorers = 0
         self.num_exploiters = 0
-        self.datacollector = DataCollector(model_reporters={"Num_Explorer": "num_explorers","Num_Exploiter": "num_exploiters"})
+        model_reporters = {
+            "Num_Explorer": "num_explorers",
+            "Num_Exploiter": "num_exploiters",
+        }
+        if USE_VERLET_LISTS:
+            model_reporters["Sense_List_Rebuild_Rate"] = lambda m: m.sense_list.rebuild_rate
+            model_reporters["Comm_List_Rebuild_Rate"] = lambda m: m.comm_list.rebuild_rate
+        self.datacollector = DataCollector(model_reporters=model_reporters)
         self.bases = self.init_base()
-        self.ages = []
-        self.memoryLens = [] # This will store average memory length at death for agent
+        self.death_records = DeathRecords()
         self.expected_ages = []
         self.member_tracker = []
         self.energy_tracker = []
+        # members born or died during the current tick, with the cells the
+        # new born are placed on, applied in one batch at the end of the tick
+        self.births = []
+        self.deaths = []
         self.decay_rates = self.init_decay_rates()
 
+        # live agents of each type, kept in step with the scheduler
+        self.explorers = dict()
+        self.exploiters = dict()
+        self.resources = dict()
+        self.registries = {
+            AgentType.EXPLORER: self.explorers,
+            AgentType.EXPLOITER: self.exploiters,
+            AgentType.ENERGY_RESERVE: self.resources,
+        }
+        if SPARSE_GRID:
+            self.occupancy = SparseOccupancy(self.registries.keys())
+        else:
+            self.occupancy = OccupancyRaster(width, height, self.registries.keys())
+        self.holders = HolderIndex()
+        self.knowledge = None
+        if USE_KNOWLEDGE_STORE:
+            self.knowledge = KnowledgeStore(self.num_energy_resources)
+        self.grid.listeners.append(self.occupancy)
+
+        self.resource_index = ResourceIndex()
+        self.neighborhoods = NeighborhoodCache(width, height)
+        self.cell_list = CellList()
+        self.comm_partners = dict()
+        if USE_VERLET_LISTS:
+            # the lists follow every move, so they only listen when used
+            self.sense_list = VerletList("sense_range")
+            self.comm_list = VerletList("communication_range")
+            self.grid.listeners.extend([self.sense_list, self.comm_list])
+
         # add social agents to the world
         for i in range(1, self.num_agents + 1):
-            if np.random.uniform() <= EXPLORER_RATIO:
+            if self.setup_rng.random() <= EXPLORER_RATIO:
                 # create a new explorer
-                a = Explorer("explorer_%d" %(i), self, coop)
+                a = Explorer(i, self, coop)
                 self.num_explorers += 1
             else:
                 # create a new exploiter
-                a = Exploiter("exploiter_%d" %(i), self, coop, e_prob)
+                a = Exploiter(i, self, coop, e_prob)
                 self.num_exploiters += 1
 
             # keep society members confined at beginning
-            x = np.random.randint(self.population_center_x - POP_SPREAD, self.population_center_x + POP_SPREAD)
-            y = np.random.randint(self.population_center_y - POP_SPREAD, self.population_center_y + POP_SPREAD)
+            x = int(self.setup_rng.integers(self.population_center_x - POP_SPREAD, self.population_center_x + POP_SPREAD))
+            y = int(self.setup_rng.integers(self.population_center_y - POP_SPREAD, self.population_center_y + POP_SPREAD))
             self.grid.place_agent(a, (x, y))
 
             # add agent to scheduler
-            self.schedule.add(a)
+            self.add_agent(a)
             self.expected_ages.append(a.energy / a.living_cost)
 
         # add energy reserves to the world
         for i in range(self.num_energy_resources):
-            a = EnergyResource("energy_reserve_%d" %(i), self, self.decay_rates[i])
+            a = EnergyResource("energy_reserve_%d" %(i), self, self.decay_rates[i], i)
 
             # decide location of energy reserve
-            x = np.random.randint(0, self.grid.width)
-            y = np.random.randint(0, self.grid.height)
+            x = int(self.setup_rng.integers(0, self.grid.width))
+            y = int(self.setup_rng.integers(0, self.grid.height))
             self.grid.place_agent(a, (x, y))
+            self.resource_index.add(a)
 
-            self.schedule.add(a)
+            self.add_agent(a)
 
     def init_base(self):
         pos = (self.population_center_x, self.population_center_y)
         return self.grid.get_neighborhood(pos, True, radius=POP_SPREAD)
 
     def init_decay_rates(self):
-        decay_rates = list(np.random.uniform(-0.1, 0.02, self.num_energy_resources))
-        np.random.shuffle(decay_rates)
+        decay_rates = list(self.setup_rng.uniform(-0.1, 0.02, self.num_energy_resources))
+        self.setup_rng.shuffle(decay_rates)
         return decay_rates
 
+    def get_neighborhood(self, pos, moore=True, radius=1, include_center=False):
+        return self.neighborhoods.get_neighborhood(pos, moore, radius, include_center)
+
+    def add_agent(self, a):
+        ''' Add agent to the scheduler and to the registry of its type '''
+        self.schedule.add(a)
+        self.registries[a.type][a.unique_id] = a
+
+    def remove_agent(self, a):
+        ''' Remove agent from the scheduler and from the registry of its type '''
+        self.schedule.remove(a)
+        del self.registries[a.type][a.unique_id]
+
+    def new_memory(self, owner):
+        if self.knowledge is not None:
+            return StoreMemory(self.knowledge, owner, owner.memory_capacity, EVICTION_POLICY)
+        return Memory(owner, self.holders, owner.memory_capacity, EVICTION_POLICY)
+
+    def forget(self, e):
+        ''' Remove a depleted energy resource from every memory '''
+        if self.knowledge is not None:
+            self.knowledge.purge(e.rid)
+        else:
+            # memories sharing a record set all lose the resource with it
+            for records in self.holders.pop(e.pos):
+                del records[e.pos]
+
+    def apply_births_and_deaths(self):
+        ''' Remove the members that died during the tick, and place the new
+        born ones, each in one batch '''
+        for a in self.deaths:
+            a.memory.clear()
+            self.remove_agent(a)
+        self.grid.remove_agents(self.deaths)
+
+        newborns = [a for a, _ in self.births]
+        self.grid.place_agents(newborns, [pos for _, pos in self.births])
+        for a in newborns:
+            self.add_agent(a)
+            if INHERIT_MEMORY:
+                # inherited records are evicted as seen from the new born's cell
+                a.memory.enforce_capacity()
+
+        born_explorers = sum(a.type == AgentType.EXPLORER for a in newborns)
+        dead_explorers = sum(a.type == AgentType.EXPLORER for a in self.deaths)
+        self.num_explorers += born_explorers - dead_explorers
+        self.num_exploiters += len(newborns) - born_explorers - (len(self.deaths) - dead_explorers)
+        self.births = []
+        self.deaths = []
+
+    def get_members(self):
+        return list(self.explorers.values()) + list(self.exploiters.values())
+
+    def sense(self):
+        '''
+        Sensing phase for the whole population at once. Members in range of
+        each energy resource are found with array operations, either from the
+        cached neighbor lists or from the full member x resource chebyshev
+        distance matrix, and the observations are handed over in bulk
+        '''
+        members = self.get_members()
+        if len(members) == 0:
+            return
+
+        # keep resources in grid order so memories are filled in the same order
+        # as with per agent sensing
+        resources = sorted(self.resource_index, key=lambda e: e.pos)
+        time = self.schedule.time
+
+        if USE_VERLET_LISTS:
+            src_idx, tgt_idx = self.sense_list.get_pairs(members, resources)
+            sources, targets = self.sense_list.sources, self.sense_list.targets
+        else:
+            sources, targets = members, resources
+            member_pos, _ = get_positions(members)
+            resource_pos, _ = get_positions(resources)
+            sense_range = np.array([a.sense_range for a in members], dtype=int)
+
+            # process members in blocks to bound the size of the distance matrix
+            src_idx, tgt_idx = [np.zeros(0, dtype=int)], [np.zeros(0, dtype=int)]
+            block = max(1, SENSE_BLOCK_SIZE // max(1, len(resources)))
+            for start in range(0, len(members), block):
+                end = start + block
+                diff = np.abs(member_pos[start:end, None, :] - resource_pos[None, :, :])
+                dist = diff.max(axis=2)
+                # a resource on the member's own cell is not sensed
+                rows, cols = np.nonzero((dist <= sense_range[start:end, None]) & (dist > 0))
+                src_idx.append(rows + start)
+                tgt_idx.append(cols)
+            src_idx, tgt_idx = np.concatenate(src_idx), np.concatenate(tgt_idx)
+
+        if self.knowledge is not None:
+            # write all observations straight into the knowledge store
+            slots = np.array([a.memory.slot for a in sources], dtype=int)[src_idx]
+            seen = [targets[j] for j in tgt_idx]
+            self.knowledge.observe(slots, np.array([e.rid for e in seen], dtype=int),
+                                   [e.pos[0] for e in seen], [e.pos[1] for e in seen],
+                                   [e.reserve for e in seen], [e.decay_rate for e in seen], time)
+            counts = self.knowledge.count([a.memory.slot for a in members])
+            for a, c in zip(members, counts):
+                if a.memory.capacity is not None and c > a.memory.capacity:
+                    a.memory.enforce_capacity()
+                    c = a.memory.capacity
+                a.update_mem_len(c)
+        else:
+            in_range = group_pairs(sources, targets, src_idx, tgt_idx)
+            for a in members:
+                a.observe(in_range.get(a, []), time)
+
     def step(self):
         self.datacollector.collect(self)
+        if BATCHED_SENSING and self.schedule.time % SENSE_STEPS == 0:
+            self.sense()
+        if BATCHED_COMMUNICATION and self.schedule.time % COMMUNICATION_STEPS == 0:
+            # partners are found once for everyone, and used in each agent's
+            # step. Exploiters never start a communication, so only explorers
+            # need partners
+            explorers = list(self.explorers.values())
+            members = self.get_members()
+            if USE_VERLET_LISTS:
+                self.comm_partners = self.comm_list.get_neighbors(explorers, members)
+            else:
+                self.comm_partners = self.cell_list.get_partners(explorers, members)
         self.schedule.step()
+        self.apply_births_and_deaths()
         self.member_tracker.append((self.num_explorers, self.num_exploiters))
 
         # keep track of total energy in world
         if self.schedule.time % 50 == 0:
-            energies = [e.reserve for e in self.schedule.agents if isinstance(e, EnergyResource)]
+            energies = [e.reserve for e in self.resources.values()]
             if len(energies) > 0:
                 mean_energy = np.mean(energies)
             else:
@@ -86,13 +271,15 @@ class World(Model):
         # change location of energy resources every 500 steps randomly
         # and change decay_rate to opposite every 100 steps
         if self.schedule.time % 50 == 0:
-            for e in self.schedule.agents:
-                if isinstance(e, EnergyResource) and np.random.uniform() < 0.1:
+            for e in self.resources.values():
+                if self.sampler.uniform() < 0.1:
                     # change location
                     e.decay_rate *= -1
                     if self.schedule.time % 500 == 0:
+                        self.resource_index.remove(e)
                         self.grid.remove_agent(e)
-                        x = np.random.randint(0, self.grid.width)
-                        y = np.random.randint(0, self.grid.height)
+                        x = self.sampler.randint(0, self.grid.width)
+                        y = self.sampler.randint(0, self.grid.height)
                         self.grid.place_agent(e, (x, y))
+                        self.resource_index.add(e)
 
@@ -0,0 +1,69 @@
+import numpy as np
+
+from enum import IntEnum
+
+from config import *
+
+class AgentType(IntEnum):
+    ''' Type code of an agent '''
+    EXPLORER = 0
+    EXPLOITER = 1
+    ENERGY_RESERVE = 2
+
+# columns of a death record, the mean memory length and the number of records
+# evicted from memory are over the member's whole life
+DEATH_RECORD_DTYPE = np.dtype([
+    ("unique_id", np.int64),
+    ("type", np.uint8),
+    ("birth", np.int64),
+    ("death", np.int64),
+    ("age", np.int64),
+    ("mem_len", np.float64),
+    ("evictions", np.int64),
+])
+
+class DeathRecords(object):
+    '''
+    Record of every society member that died in a world, in order of death,
+    held in one structured array that doubles in size when full. Columns are
+    returned as views of the filled part of the array, so statistics are
+    array reductions and log writers get the data without copies
+    '''
+    def __init__(self, capacity=DEATH_RECORDS_CAPACITY):
+        self.records = np.zeros(capacity, dtype=DEATH_RECORD_DTYPE)
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def reserve(self, n):
+        ''' Make room for n more records '''
+        if self.size + n > len(self.records):
+            records = np.zeros(max(2 * len(self.records), self.size + n), dtype=DEATH_RECORD_DTYPE)
+            records[:self.size] = self.records[:self.size]
+            self.records = records
+
+    def append(self, unique_id, agent_type, birth, death, age, mem_len, evictions=0):
+        self.reserve(1)
+        self.records[self.size] = (unique_id, agent_type, birth, death, age, mem_len, evictions)
+        self.size += 1
+
+    def extend(self, **columns):
+        ''' Append a batch of records given as one array per column, columns
+        left out are zero '''
+        n = len(next(iter(columns.values())))
+        self.reserve(n)
+        batch = self.records[self.size:self.size + n]
+        for name, values in columns.items():
+            batch[name] = values
+        self.size += n
+
+    def get(self, column, agent_type=None):
+        ''' View of a column, or the values of the members of one type '''
+        values = self.records[column][:self.size]
+        if agent_type is None:
+            return values
+        return values[self.records["type"][:self.size] == agent_type]
+
+    def mean(self, column, agent_type=None):
+        return np.mean(self.get(column, agent_type))
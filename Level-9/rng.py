@@ -0,0 +1,141 @@
+import numpy as np
+from array import array
+
+from config import *
+
+def get_drift_dist(drift):
+    ''' Gives a probability distribution of selecting neighbor cells
+    so that overall a drift is achieved in one direction '''
+    dist = [0.25 / 5] * 8
+    if drift == 0:
+        idx = [5, 6, 7]
+    elif drift == 1:
+        idx = [2, 4, 7]
+    elif drift == 2:
+        idx = [0, 1, 2]
+    elif drift == 3:
+        idx = [0, 3, 5]
+
+    for i in idx:
+        dist[i] = 0.25
+    return dist
+
+def to_array(values):
+    ''' Pack float64 values in a flat array, which takes a quarter of the
+    memory of a list of floats '''
+    a = array("d")
+    a.frombytes(values.tobytes())
+    return a
+
+# keys of the random streams of a World, the members and resources streams
+# are further keyed by the serial number of the agent. ArrayWorld draws for
+# the whole population from a single stream
+SETUP_STREAM = 0
+SCHEDULE_STREAM = 1
+RELOCATION_STREAM = 2
+MEMBER_STREAM = 3
+RESOURCE_STREAM = 4
+ARRAY_STREAM = 5
+
+# cumulative tables of the drift distributions, one row per direction
+DRIFT_CDFS = np.cumsum([get_drift_dist(d) for d in DIRECTIONS], axis=1)
+DRIFT_CDFS = DRIFT_CDFS / DRIFT_CDFS[:, -1:]
+
+class Streams(object):
+    '''
+    Independent random streams of one World, all derived from a single seed.
+    Each stream is a counter-based Philox generator whose key is hashed from
+    the seed and the stream key alone, so the draws an agent or a phase sees
+    do not depend on how many other streams exist, in which order they were
+    created, or on which process they run
+    '''
+    def __init__(self, seed=None):
+        # without a seed fresh entropy is used, and kept so the run can be repeated
+        self.seed = np.random.SeedSequence(seed).entropy
+
+    def get_seed_sequence(self, *key):
+        return np.random.SeedSequence(self.seed, spawn_key=key)
+
+    def get_generator(self, *key):
+        return np.random.Generator(np.random.Philox(self.get_seed_sequence(*key)))
+
+    def get_int_seed(self, *key):
+        ''' Integer seed for consumers that need their own generator type '''
+        return int(self.get_seed_sequence(*key).generate_state(1, np.uint64)[0])
+
+    def get_sampler(self, *key, block_size=SAMPLER_BLOCK_SIZE):
+        return Sampler(self.get_generator(*key), block_size)
+
+class Sampler(object):
+    ''' Random stream of one agent or phase. Uniforms and normals are drawn
+    from its generator a block at a time and handed out one by one, so that
+    agents pay an array lookup instead of a numpy call per draw. Pools are only
+    filled once drawn from, starting at FIRST_SAMPLER_BLOCK_SIZE draws and
+    doubling on each refill up to block_size, so members which draw little
+    hold few pre-generated draws.
+
+    Drift moves for explorers are drawn a block at a time too: one block of
+    uniforms is mapped through the cumulative tables of all four drift
+    distributions with one searchsorted each, and every move is then a
+    lookup into a byte string '''
+    __slots__ = ("rng", "block_size", "moves", "next_move",
+                 "uniforms", "next_uniform", "normals", "next_normal")
+
+    def __init__(self, rng, block_size=SAMPLER_BLOCK_SIZE):
+        self.rng = rng
+        self.block_size = block_size
+        self.moves = None
+        self.next_move = 0
+        self.uniforms = None
+        self.next_uniform = 0
+        self.normals = None
+        self.next_normal = 0
+
+    def get_pool_size(self, pool):
+        if pool is None:
+            return min(FIRST_SAMPLER_BLOCK_SIZE, self.block_size)
+        return min(2 * len(pool), self.block_size)
+
+    def refill_moves(self):
+        u = self.rng.random(self.get_pool_size(None if self.moves is None else self.moves[0]))
+        # neighbor indices fit in a byte
+        self.moves = [np.searchsorted(cdf, u, side="right").astype(np.uint8).tobytes() for cdf in DRIFT_CDFS]
+        self.next_move = 0
+
+    def drift_move(self, drift):
+        ''' Index of the neighbor cell an explorer with this drift moves to '''
+        if self.moves is None or self.next_move == len(self.moves[0]):
+            self.refill_moves()
+        k = self.next_move
+        self.next_move += 1
+        return self.moves[drift][k]
+
+    def uniform(self, low=0.0, high=1.0):
+        ''' Uniform draw in [low, high) '''
+        if self.uniforms is None or self.next_uniform == len(self.uniforms):
+            self.uniforms = to_array(self.rng.random(self.get_pool_size(self.uniforms)))
+            self.next_uniform = 0
+        u = self.uniforms[self.next_uniform]
+        self.next_uniform += 1
+        return low + (high - low) * u
+
+    def normal(self, loc=0.0, scale=1.0):
+        ''' Gaussian draw with mean loc and standard deviation scale '''
+        if self.normals is None or self.next_normal == len(self.normals):
+            self.normals = to_array(self.rng.standard_normal(self.get_pool_size(self.normals)))
+            self.next_normal = 0
+        z = self.normals[self.next_normal]
+        self.next_normal += 1
+        return loc + scale * z
+
+    def random(self, size):
+        ''' Array of uniforms in [0, 1), drawn straight from the generator '''
+        return self.rng.random(size)
+
+    def randint(self, low, high):
+        ''' Integer draw in [low, high) '''
+        return low + min(int(self.uniform() * (high - low)), high - low - 1)
+
+    def choice(self, seq):
+        ''' Uniformly chosen element of a non-empty sequence '''
+        return seq[self.randint(0, len(seq))]
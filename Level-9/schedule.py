@@ -0,0 +1,41 @@
+from mesa.time import BaseScheduler
+
+# phases of a tick in the order they run, and whether agents take their turn
+# in random order. Sensing and paying living costs do not depend on what other
+# agents do in the same phase, while memory sharing, competing for energy and
+# giving birth do
+PHASES = [
+    ("sense", False),
+    ("communicate", True),
+    ("move", True),
+    ("metabolize", False),
+    ("lifecycle", True),
+]
+
+class PhasedActivation(BaseScheduler):
+    '''
+    Runs each phase of a tick across the whole population before moving on to
+    the next. An agent takes part in a phase through its step_<phase> method,
+    and sits the phase out when it has none. Agents removed during a phase miss
+    the rest of the tick, and agents added during a phase start next tick.
+
+    Unlike mesa's StagedActivation, time advances by whole ticks, so agents
+    checking schedule.time against an interval see the same value throughout
+    the tick
+    '''
+    def __init__(self, model, phases=PHASES):
+        super().__init__(model)
+        self.phases = phases
+
+    def run_phase(self, phase, shuffled):
+        name = "step_" + phase
+        for agent in self.agent_buffer(shuffled=shuffled):
+            step = getattr(agent, name, None)
+            if step is not None:
+                step()
+
+    def step(self):
+        for phase, shuffled in self.phases:
+            self.run_phase(phase, shuffled)
+        self.steps += 1
+        self.time += 1
@@ -2,9 +2,10 @@ from mesa.visualization.modules import CanvasGrid
 from mesa.visualization.modules import ChartModule
 from mesa.visualization.ModularVisualization import ModularServer
 from model import World
+from registry import AgentType
 
 def agent_portrayal(agent):
-    if agent.type == "explorer":
+    if agent.type == AgentType.EXPLORER:
         return {
                 "Shape": "circle",
                 "Filled": "true",
@@ -12,7 +13,7 @@ def agent_portrayal(agent):
                 "Color": "blue",
                 "r": 0.8,
                 }
-    elif agent.type == "exploiter":
+    elif agent.type == AgentType.EXPLOITER:
         return {
                 "Shape": "circle",
                 "Filled": "true",
@@ -0,0 +1,602 @@
+import itertools
+import numpy as np
+
+from collections import OrderedDict
+
+from mesa.space import MultiGrid, accept_tuple_argument
+
+from config import *
+
+class ResourceIndex(object):
+    ''' Spatial hash of energy resource positions. Resources are bucketed
+    into square blocks of bucket_size cells, so a range query only visits
+    the blocks overlapping the query square instead of every grid cell '''
+    def __init__(self, bucket_size=RESOURCE_BUCKET_SIZE):
+        self.bucket_size = bucket_size
+        self.buckets = dict()
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        for bucket in self.buckets.values():
+            yield from bucket
+
+    def get_bucket(self, pos):
+        return (pos[0] // self.bucket_size, pos[1] // self.bucket_size)
+
+    def add(self, resource):
+        key = self.get_bucket(resource.pos)
+        self.buckets.setdefault(key, []).append(resource)
+        self.size += 1
+
+    def remove(self, resource):
+        key = self.get_bucket(resource.pos)
+        bucket = self.buckets[key]
+        bucket.remove(resource)
+        if len(bucket) == 0:
+            del self.buckets[key]
+        self.size -= 1
+
+    def get_neighbors(self, pos, radius, include_center=False):
+        '''
+        Return the resources within chebyshev distance radius of pos, in
+        the same order as MultiGrid.get_neighbors would have listed them
+        '''
+        x, y = pos
+        b = self.bucket_size
+        found = []
+        for bx in range((x - radius) // b, (x + radius) // b + 1):
+            for by in range((y - radius) // b, (y + radius) // b + 1):
+                bucket = self.buckets.get((bx, by))
+                if bucket is None:
+                    continue
+                for e in bucket:
+                    dx = abs(e.pos[0] - x)
+                    dy = abs(e.pos[1] - y)
+                    if dx > radius or dy > radius:
+                        continue
+                    if dx == 0 and dy == 0 and not include_center:
+                        continue
+                    found.append(e)
+
+        # grid order is by cell, then by order of placement within the cell
+        found.sort(key=lambda e: e.pos)
+        return found
+
+class NeighborhoodCache(object):
+    ''' Bounded cache of grid neighborhoods keyed by (pos, radius, moore).
+    Neighborhoods are built from precomputed offset tables, clipped at the
+    grid boundary, and shared between callers as immutable tuples in the
+    same order as MultiGrid.get_neighborhood. The least recently used
+    entries are dropped once max_size neighborhoods are stored '''
+    def __init__(self, width, height, max_size=NEIGHBORHOOD_CACHE_SIZE, torus=False):
+        self.width = width
+        self.height = height
+        self.max_size = max_size
+        self.torus = torus
+        self.offsets = dict()
+        self.cache = OrderedDict()
+
+    def get_offsets(self, radius, moore, include_center):
+        key = (radius, moore, include_center)
+        offsets = self.offsets.get(key)
+        if offsets is None:
+            offsets = []
+            for dx in range(-radius, radius + 1):
+                for dy in range(-radius, radius + 1):
+                    if dx == 0 and dy == 0 and not include_center:
+                        continue
+                    if not moore and abs(dx) + abs(dy) > radius:
+                        continue
+                    offsets.append((dx, dy))
+            offsets = tuple(offsets)
+            self.offsets[key] = offsets
+        return offsets
+
+    def get_neighborhood(self, pos, moore=True, radius=1, include_center=False):
+        key = (pos, radius, moore, include_center)
+        nbrs = self.cache.get(key)
+        if nbrs is not None:
+            self.cache.move_to_end(key)
+            return nbrs
+
+        x, y = pos
+        offsets = self.get_offsets(radius, moore, include_center)
+        if radius <= x < self.width - radius and radius <= y < self.height - radius:
+            nbrs = tuple((x + dx, y + dy) for dx, dy in offsets)
+        elif self.torus:
+            # wrap around, cells reached twice on a small grid are listed once
+            nbrs = tuple(sorted(set(((x + dx) % self.width, (y + dy) % self.height) for dx, dy in offsets)))
+        else:
+            # clip the neighborhood at the grid boundary
+            nbrs = tuple((x + dx, y + dy) for dx, dy in offsets
+                         if 0 <= x + dx < self.width and 0 <= y + dy < self.height)
+
+        self.cache[key] = nbrs
+        if len(self.cache) > self.max_size:
+            self.cache.popitem(last=False)
+        return nbrs
+
+def get_positions(agents):
+    '''
+    Return the positions of agents as an array, along with a mask telling
+    which of them are still on the grid
+    '''
+    alive = np.array([a.pos is not None for a in agents], dtype=bool)
+    pos = np.array([a.pos if a.pos is not None else (0, 0) for a in agents], dtype=int)
+    return pos.reshape(-1, 2), alive
+
+def group_pairs(sources, targets, src_idx, tgt_idx):
+    '''
+    Turn index arrays of (source, target) pairs sorted by source into a dict
+    mapping each source agent to its list of target agents
+    '''
+    groups = dict()
+    if len(src_idx) == 0:
+        return groups
+    starts = np.flatnonzero(np.diff(src_idx)) + 1
+    for idx in np.split(np.arange(len(src_idx)), starts):
+        groups[sources[src_idx[idx[0]]]] = [targets[j] for j in tgt_idx[idx]]
+    return groups
+
+class Partners(object):
+    '''
+    Targets of each source agent, held as one array of target indices in which
+    the targets of source i are tgt_idx[begin[i]:end[i]]. The list of targets
+    of a source is only built when it is asked for, so no per-source lists are
+    held for the whole population at once
+    '''
+    def __init__(self, sources, targets, begin, end, tgt_idx):
+        self.targets = targets
+        self.index = dict((a, i) for i, a in enumerate(sources))
+        self.begin = begin
+        self.end = end
+        self.tgt_idx = tgt_idx
+
+    @classmethod
+    def from_pairs(cls, sources, targets, src_idx, tgt_idx):
+        ''' Partners from index arrays of pairs sorted by source '''
+        i = np.arange(len(sources))
+        return cls(sources, targets, np.searchsorted(src_idx, i), np.searchsorted(src_idx, i, side="right"), tgt_idx)
+
+    def get(self, source, default=None):
+        i = self.index.get(source)
+        if i is None or self.begin[i] == self.end[i]:
+            return default
+        return [self.targets[j] for j in self.tgt_idx[self.begin[i]:self.end[i]].tolist()]
+
+def window_sum(a, radius):
+    '''
+    Sum of a over the (2 * radius + 1) square window around every cell of
+    its last two axes, with the window clipped at the grid boundary
+    '''
+    for axis in (-2, -1):
+        n = a.shape[axis]
+        c = np.cumsum(a, axis=axis)
+        c = np.concatenate([np.zeros_like(c.take([0], axis=axis)), c], axis=axis)
+        idx = np.arange(n)
+        hi = np.minimum(idx + radius + 1, n)
+        lo = np.maximum(idx - radius, 0)
+        a = c.take(hi, axis=axis) - c.take(lo, axis=axis)
+    return a
+
+def window_max(a, radius, fill=-1):
+    '''
+    Max of a over the (2 * radius + 1) square window around every cell of
+    its last two axes, with the window clipped at the grid boundary. Uses
+    block prefix and suffix maxima, so the cost does not grow with radius
+    '''
+    k = 2 * radius + 1
+    for axis in (-2, -1):
+        b = np.moveaxis(a, axis, -1)
+        n = b.shape[-1]
+        # pad so that every window lies inside, and blocks of k tile the axis
+        length = -(-(n + 2 * radius) // k) * k
+        padded = np.full(b.shape[:-1] + (length,), fill, dtype=a.dtype)
+        padded[..., radius:radius + n] = b
+        blocks = padded.reshape(b.shape[:-1] + (length // k, k))
+        prefix = np.maximum.accumulate(blocks, axis=-1).reshape(padded.shape)
+        suffix = np.maximum.accumulate(blocks[..., ::-1], axis=-1)[..., ::-1].reshape(padded.shape)
+        b = np.maximum(suffix[..., :n], prefix[..., k - 1:k - 1 + n])
+        a = np.moveaxis(b, -1, axis)
+    return a
+
+class SparseMultiGrid(MultiGrid):
+    '''
+    MultiGrid which only stores the cells that hold agents, in a dict keyed
+    by position, so memory scales with the number of agents rather than the
+    area of the grid, and building a grid takes constant time whatever its
+    size. Placing, moving and removing agents, indexing, neighborhoods and
+    neighbors behave as in MultiGrid, with neighborhoods kept in a bounded
+    NeighborhoodCache rather than in mesa's cache, which never drops any.
+    Iterating over the grid only visits occupied cells, and there is no list
+    of empty cells to pick from
+    '''
+    def __init__(self, width, height, torus):
+        self.width = width
+        self.height = height
+        self.torus = torus
+        self.cells = dict()
+        self.neighborhoods = NeighborhoodCache(width, height, torus=torus)
+
+    def __getitem__(self, index):
+        if isinstance(index, int):
+            # grid[x], the column at x
+            x = range(self.width)[index]
+            return [self.cells.get((x, y), []) for y in range(self.height)]
+        if isinstance(index[0], tuple):
+            return [self.cells.get(self.torus_adj(pos), []) for pos in index]
+
+        x, y = index
+        if isinstance(x, int) and isinstance(y, int):
+            return self.cells.get(self.torus_adj(index), [])
+        # grid[x, :], grid[:, y] and grid[:, :], column by column
+        if isinstance(x, int):
+            x, _ = self.torus_adj((x, 0))
+            x = slice(x, x + 1)
+        if isinstance(y, int):
+            _, y = self.torus_adj((0, y))
+            y = slice(y, y + 1)
+        return [self.cells.get((i, j), []) for i in range(self.width)[x] for j in range(self.height)[y]]
+
+    def __iter__(self):
+        return itertools.chain.from_iterable(self.cells.values())
+
+    def coord_iter(self):
+        for (x, y), cell in self.cells.items():
+            yield cell, x, y
+
+    def _place_agent(self, pos, agent):
+        cell = self.cells.setdefault(pos, [])
+        if agent not in cell:
+            cell.append(agent)
+
+    def _remove_agent(self, pos, agent):
+        cell = self.cells[pos]
+        cell.remove(agent)
+        if len(cell) == 0:
+            del self.cells[pos]
+
+    def get_neighborhood(self, pos, moore, include_center=False, radius=1):
+        # a list, as mesa's accept_tuple_argument takes a tuple of two cells
+        # for a single position
+        return list(self.neighborhoods.get_neighborhood(pos, moore, radius, include_center))
+
+    def is_cell_empty(self, pos):
+        return pos not in self.cells
+
+    def exists_empty_cells(self):
+        return len(self.cells) < self.width * self.height
+
+    @accept_tuple_argument
+    def iter_cell_list_contents(self, cell_list):
+        return itertools.chain.from_iterable(self.cells[pos] for pos in cell_list if pos in self.cells)
+
+class GridTracker(object):
+    ''' Grid mixin which lets listeners know whenever an agent is placed,
+    moved or removed, so that structures built from agent positions can be
+    kept in step with the grid '''
+    def __init__(self, width, height, torus):
+        super().__init__(width, height, torus)
+        self.listeners = []
+
+    def place_agent(self, agent, pos):
+        super().place_agent(agent, pos)
+        for l in self.listeners:
+            l.on_place(agent, agent.pos)
+
+    def move_agent(self, agent, pos):
+        old_pos = agent.pos
+        super().move_agent(agent, pos)
+        for l in self.listeners:
+            l.on_move(agent, old_pos, agent.pos)
+
+    def remove_agent(self, agent):
+        pos = agent.pos
+        super().remove_agent(agent)
+        for l in self.listeners:
+            l.on_remove(agent, pos)
+
+    def place_agents(self, agents, positions):
+        ''' Place many agents at once, listeners are let know after all of
+        them are on the grid '''
+        for agent, pos in zip(agents, positions):
+            super().place_agent(agent, pos)
+        for l in self.listeners:
+            for agent in agents:
+                l.on_place(agent, agent.pos)
+
+    def remove_agents(self, agents):
+        positions = [agent.pos for agent in agents]
+        for agent in agents:
+            super().remove_agent(agent)
+        for l in self.listeners:
+            for agent, pos in zip(agents, positions):
+                l.on_remove(agent, pos)
+
+class TrackedMultiGrid(GridTracker, MultiGrid):
+    pass
+
+class TrackedSparseGrid(GridTracker, SparseMultiGrid):
+    pass
+
+class OccupancyRaster(object):
+    ''' Integer count of the agents of each type on every cell of the grid.
+    Answers whether a cell holds an agent of some type in constant time, and
+    counts agents in a window with a single array slice '''
+    def __init__(self, width, height, agent_types):
+        self.width = width
+        self.height = height
+        self.counts = {t: np.zeros((width, height), dtype=np.int32) for t in agent_types}
+
+    def on_place(self, agent, pos):
+        self.counts[agent.type][pos] += 1
+
+    def on_move(self, agent, old_pos, pos):
+        counts = self.counts[agent.type]
+        counts[old_pos] -= 1
+        counts[pos] += 1
+
+    def on_remove(self, agent, pos):
+        self.counts[agent.type][pos] -= 1
+
+    def is_occupied(self, agent_type, pos):
+        return self.counts[agent_type][pos] > 0
+
+    def get_window(self, agent_type, pos, radius):
+        ''' Return the counts around pos and the coordinate of its corner '''
+        x, y = pos
+        x0, y0 = max(0, x - radius), max(0, y - radius)
+        x1, y1 = min(self.width, x + radius + 1), min(self.height, y + radius + 1)
+        return self.counts[agent_type][x0:x1, y0:y1], (x0, y0)
+
+    def count(self, agent_type, pos, radius, include_center=False):
+        window, _ = self.get_window(agent_type, pos, radius)
+        total = int(window.sum())
+        if not include_center:
+            total -= int(self.counts[agent_type][pos])
+        return total
+
+    def get_occupied(self, agent_type, pos, radius, include_center=False):
+        '''
+        Return the cells around pos holding agents of agent_type, in the same
+        order as MultiGrid.get_neighborhood
+        '''
+        window, (x0, y0) = self.get_window(agent_type, pos, radius)
+        rows, cols = np.nonzero(window)
+        cells = [(x0 + i, y0 + j) for i, j in zip(rows.tolist(), cols.tolist())]
+        if not include_center and self.counts[agent_type][pos] > 0:
+            cells.remove(pos)
+        return cells
+
+class SparseOccupancy(object):
+    '''
+    Count of the agents of each type on the cells that hold any, answering
+    the queries of OccupancyRaster. A window is scanned cell by cell, or the
+    occupied cells of the type are filtered, whichever is fewer
+    '''
+    def __init__(self, agent_types):
+        self.counts = {t: dict() for t in agent_types}
+
+    def on_place(self, agent, pos):
+        counts = self.counts[agent.type]
+        counts[pos] = counts.get(pos, 0) + 1
+
+    def on_move(self, agent, old_pos, pos):
+        self.on_remove(agent, old_pos)
+        self.on_place(agent, pos)
+
+    def on_remove(self, agent, pos):
+        counts = self.counts[agent.type]
+        counts[pos] -= 1
+        if counts[pos] == 0:
+            del counts[pos]
+
+    def is_occupied(self, agent_type, pos):
+        return pos in self.counts[agent_type]
+
+    def get_window(self, agent_type, pos, radius):
+        ''' Return the occupied cells around pos in grid order '''
+        counts = self.counts[agent_type]
+        x, y = pos
+        if (2 * radius + 1) ** 2 < len(counts):
+            return [(i, j) for i in range(x - radius, x + radius + 1)
+                    for j in range(y - radius, y + radius + 1) if (i, j) in counts]
+        return sorted(c for c in counts if abs(c[0] - x) <= radius and abs(c[1] - y) <= radius)
+
+    def count(self, agent_type, pos, radius, include_center=False):
+        counts = self.counts[agent_type]
+        total = sum(counts[c] for c in self.get_window(agent_type, pos, radius))
+        if not include_center:
+            total -= counts.get(pos, 0)
+        return total
+
+    def get_occupied(self, agent_type, pos, radius, include_center=False):
+        '''
+        Return the cells around pos holding agents of agent_type, in the same
+        order as MultiGrid.get_neighborhood
+        '''
+        cells = self.get_window(agent_type, pos, radius)
+        if not include_center and pos in self.counts[agent_type]:
+            cells.remove(pos)
+        return cells
+
+class CellList(object):
+    ''' Enumerates pairs of nearby agents by bucketing them into square cells
+    of side cell_size. As long as no cutoff is larger than cell_size, the
+    pairs of an agent can only be found in the 3x3 block of cells around it '''
+    def __init__(self, cell_size=EXPLORER_COMM_RANGE):
+        self.cell_size = cell_size
+
+    def iter_blocks(self, src_pos, cutoff, tgt_pos, include_center=True):
+        '''
+        Yield the source/target pairs within chebyshev distance cutoff[i] of
+        each other in blocks of (sources, rows, targets): the pairs are
+        (sources[rows], targets), sources of a block are increasing, and the
+        targets of a source are in grid order. Every source is in one block
+        only, and the distances computed at once are bounded by
+        SENSE_BLOCK_SIZE
+        '''
+        if len(src_pos) == 0 or len(tgt_pos) == 0:
+            return
+        if cutoff.max() > self.cell_size:
+            raise ValueError("cutoff exceeds cell size of %d" %(self.cell_size))
+
+        buckets = dict()
+        for j, cell in enumerate(map(tuple, (tgt_pos // self.cell_size).tolist())):
+            buckets.setdefault(cell, []).append(j)
+        groups = dict()
+        for i, cell in enumerate(map(tuple, (src_pos // self.cell_size).tolist())):
+            groups.setdefault(cell, []).append(i)
+
+        for (cx, cy), idx in groups.items():
+            nbrs = []
+            for dx in (-1, 0, 1):
+                for dy in (-1, 0, 1):
+                    nbrs.extend(buckets.get((cx + dx, cy + dy), ()))
+            if len(nbrs) == 0:
+                continue
+            nbrs = np.array(nbrs, dtype=np.int32)
+            nbrs = nbrs[np.lexsort((nbrs, tgt_pos[nbrs, 1], tgt_pos[nbrs, 0]))]
+
+            block = max(1, SENSE_BLOCK_SIZE // len(nbrs))
+            for start in range(0, len(idx), block):
+                sources = np.array(idx[start:start + block])
+                dist = np.abs(src_pos[sources, None, :] - tgt_pos[None, nbrs, :]).max(axis=2)
+                within = dist <= cutoff[sources, None]
+                if not include_center:
+                    within &= dist > 0
+                rows, cols = np.nonzero(within)
+                yield sources, rows, nbrs[cols]
+
+    def get_pairs(self, src_pos, cutoff, tgt_pos):
+        '''
+        Return index arrays (i, j) of all source/target pairs within chebyshev
+        distance cutoff[i] of each other. Pairs are sorted by source, and the
+        targets of a source are in grid order
+        '''
+        empty = np.zeros(0, dtype=int)
+        src_idx, tgt_idx = [empty], [empty]
+        for sources, rows, targets in self.iter_blocks(src_pos, cutoff, tgt_pos):
+            src_idx.append(sources[rows])
+            tgt_idx.append(targets)
+
+        src_idx = np.concatenate(src_idx)
+        tgt_idx = np.concatenate(tgt_idx)
+        order = np.argsort(src_idx, kind="stable")
+        return src_idx[order], tgt_idx[order]
+
+    def get_partners(self, sources, targets):
+        '''
+        Return the Partners of each source, the targets within its
+        communication_range excluding targets on the same cell, in grid order.
+        The targets are kept in the order blocks are found, each source
+        pointing at its own range of them, so the pairs are never sorted
+        '''
+        src_pos, _ = get_positions(sources)
+        tgt_pos, _ = get_positions(targets)
+        ranges = np.array([a.communication_range for a in sources], dtype=int)
+        begin = np.zeros(len(sources), dtype=int)
+        end = np.zeros(len(sources), dtype=int)
+        tgt_idx = [np.zeros(0, dtype=np.int32)]
+        offset = 0
+        for blk, rows, found in self.iter_blocks(src_pos, ranges, tgt_pos, include_center=False):
+            counts = np.bincount(rows, minlength=len(blk))
+            end[blk] = offset + np.cumsum(counts)
+            begin[blk] = end[blk] - counts
+            offset += len(found)
+            tgt_idx.append(found)
+        return Partners(sources, targets, begin, end, np.concatenate(tgt_idx))
+
+class VerletList(object):
+    ''' Neighbor lists built with a cutoff of range + skin, and reused until
+    some agent has moved more than skin / 2 cells since the last build. Up to
+    then no pair that was farther apart than the cutoff can have come within
+    range, so queries only need to filter the cached candidate pairs '''
+    def __init__(self, range_attr, skin=VERLET_SKIN):
+        self.range_attr = range_attr
+        self.skin = skin
+        self.sources = []
+        self.targets = []
+        self.ranges = None
+        self.src_idx = None
+        self.tgt_idx = None
+        self.ref_pos = dict()
+        self.max_displacement = 0
+        self.stale = True
+        self.num_builds = 0
+        self.num_queries = 0
+
+    @property
+    def rebuild_rate(self):
+        if self.num_queries == 0:
+            return 0
+        return self.num_builds / self.num_queries
+
+    def on_place(self, agent, pos):
+        # a newly placed agent is missing from the cached pairs
+        self.stale = True
+
+    def on_remove(self, agent, pos):
+        # agents removed from the grid are filtered out on every query
+        pass
+
+    def on_move(self, agent, old_pos, pos):
+        ref = self.ref_pos.get(agent)
+        if ref is None:
+            return
+        d = max(abs(pos[0] - ref[0]), abs(pos[1] - ref[1]))
+        if d > self.max_displacement:
+            self.max_displacement = d
+
+    def needs_rebuild(self):
+        # two agents can approach each other by twice the max displacement
+        return self.stale or 2 * self.max_displacement > self.skin
+
+    def build(self, sources, targets):
+        self.sources = sources
+        self.targets = targets
+        self.ranges = np.array([getattr(a, self.range_attr) for a in sources], dtype=int)
+        src_pos, _ = get_positions(sources)
+        tgt_pos, _ = get_positions(targets)
+        cutoff = self.ranges + self.skin
+        cell_list = CellList(max(1, int(cutoff.max(initial=0))))
+        self.src_idx, self.tgt_idx = cell_list.get_pairs(src_pos, cutoff, tgt_pos)
+
+        self.ref_pos = {a: a.pos for a in sources}
+        self.ref_pos.update((a, a.pos) for a in targets)
+        self.max_displacement = 0
+        self.stale = False
+        self.num_builds += 1
+
+    def get_pairs(self, sources, targets):
+        '''
+        Return index arrays (i, j) into self.sources and self.targets of the
+        pairs within range of each other, excluding pairs on the same cell.
+        The lists are rebuilt from the given sources and targets only when
+        the cached pairs may be out of date
+        '''
+        self.num_queries += 1
+        if self.needs_rebuild():
+            self.build(sources, targets)
+
+        src_pos, src_alive = get_positions(self.sources)
+        tgt_pos, tgt_alive = get_positions(self.targets)
+        src_idx, tgt_idx = self.src_idx, self.tgt_idx
+        dist = np.abs(src_pos[src_idx] - tgt_pos[tgt_idx]).max(axis=1)
+        keep = (dist <= self.ranges[src_idx]) & (dist > 0) & src_alive[src_idx] & tgt_alive[tgt_idx]
+        src_idx, tgt_idx = src_idx[keep], tgt_idx[keep]
+
+        # agents have moved since the build, so restore grid order of targets
+        order = np.lexsort((tgt_idx, tgt_pos[tgt_idx, 1], tgt_pos[tgt_idx, 0], src_idx))
+        return src_idx[order], tgt_idx[order]
+
+    def get_neighbors(self, sources, targets):
+        '''
+        Return the Partners of each source, the targets within its range
+        excluding targets on the same cell
+        '''
+        src_idx, tgt_idx = self.get_pairs(sources, targets)
+        return Partners.from_pairs(self.sources, self.targets, src_idx, tgt_idx)